@@ -0,0 +1,65 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# the prefixes dbpedia and wikidata declare implicitly
+PREFIXES = """PREFIX dbo: <http://dbpedia.org/ontology/>
+PREFIX dbr: <http://dbpedia.org/resource/>
+PREFIX dbd: <http://dbpedia.org/datatype/>
+PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+"""
+
+class LocalEndpoint:
+    # SPARQL protocol over an rdflib graph on localhost, the path makes the generator take its dbpedia branch
+    def __init__(self, graph, latency: float = 0.0, port: int = 0, path: str = "/dbpedia/sparql"):
+        self.graph = graph
+        self.latency = latency
+        self.requests = 0
+        # rdflib's query engine is not thread-safe
+        self.lock = threading.Lock()
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                endpoint.answer(self, parse_qs(urlparse(self.path).query)["query"][0])
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                if "urlencoded" in self.headers.get("Content-Type", ""):
+                    data = parse_qs(data)["query"][0]
+                endpoint.answer(self, data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def answer(self, handler, query):
+        if self.latency:
+            # network round trip of a real endpoint, outside the lock so requests overlap
+            threading.Event().wait(self.latency)
+        try:
+            with self.lock:
+                self.requests += 1
+                body = self.graph.query(PREFIXES + query).serialize(format="json")
+        except Exception as e:
+            handler.send_response(400)
+            handler.end_headers()
+            handler.wfile.write(str(e).encode("utf-8"))
+            return
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/sparql-results+json")
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
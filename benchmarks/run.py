@@ -0,0 +1,237 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "dataset"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from rdflib import Graph
+from generator import QADatasetGenerator
+from verbalizer import Verbalizer
+from timeout import Deadline
+from stub_llm import StubChatModel
+from synthetic import ensure_graph
+from endpoint import LocalEndpoint
+
+COURSES = os.path.join(ROOT, "dataset", "io", "kg_courses.ttl")
+CLASSES = os.path.join(ROOT, "dataset", "io", "classes_allowed.txt")
+# what a worker process or main.py --help must not import before it knows the source and the verbalizer
+HEAVY_MODULES = ["pandas", "rdflib", "numpy", "requests", "SPARQLWrapper", "langchain_core", "langchain_community", "langchain_huggingface"]
+STARTUP_IMPORTS = "import sys; sys.path.insert(0, {path!r}); import generator, backends, parallel; print(' '.join(m for m in {heavy!r} if m in sys.modules))"
+WORKLOADS = [("simple_1", False), ("simple_1", True), ("simple_2", False), ("simple_2", True), ("complex_1", False), ("complex_2", False)]
+
+def load_excluded_props():
+    with open(os.path.join(ROOT, "dataset", "io", "excluded_props.txt"), "r") as f:
+        return [line.strip() for line in f.readlines()]
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+@contextlib.contextmanager
+def quiet(enabled: bool = True):
+    # the generator reports every rejected sample on stdout
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.excluded_props = load_excluded_props()
+        self.results = []
+        self.failures = []
+        self.workdir = tempfile.mkdtemp(prefix="frog-bench-")
+
+    def verbalizer(self):
+        return Verbalizer(chat_model=StubChatModel(self.args.llm_latency), concurrency=self.args.llm_concurrency,
+                          batch_size=self.args.llm_batch_size)
+
+    def generator(self, source, **kwargs):
+        return QADatasetGenerator(source, self.excluded_props, self.args.timeout, classes_file=CLASSES,
+                                  label_cache=os.path.join(self.workdir, "labels.sqlite"), verbalizer=self.verbalizer(), **kwargs)
+
+    def record(self, scenario, graph, seconds, ops = None, **extra):
+        result = {"scenario": scenario, "graph": graph, "seconds": round(seconds, 4)}
+        if ops is not None:
+            result["ops"] = ops
+            result["ops_per_s"] = round(ops / seconds, 2) if seconds > 0 else None
+        result.update(extra)
+        self.results.append(result)
+        print(f"{scenario:<10} {graph:<24} {extra.get('category', ''):<10} {'count' if extra.get('count') else '':<5} "
+              f"{seconds:9.3f}s" + (f" {result['ops_per_s']:>10} ops/s" if ops is not None else ""), file=sys.stderr)
+
+    def graphs(self):
+        graphs = []
+        if not self.args.no_courses:
+            graphs.append(("kg_courses", COURSES, None))
+        for size in self.args.sizes:
+            graphs.append((f"synthetic_{size}", ensure_graph(self.args.data_dir, size, self.args.seed), size))
+        return graphs
+
+    def run_local(self, name, path, triples):
+        for snapshot in ([False, True] if self.args.snapshot else [False]):
+            label = f"{name}+snapshot" if snapshot else name
+            if snapshot:
+                # built outside the timing, what matters is loading an existing one
+                with quiet():
+                    self.generator(path, snapshot=True)
+            start = time.perf_counter()
+            with quiet():
+                generator = self.generator(path, snapshot=snapshot)
+            self.record("load", label, time.perf_counter() - start, triples=triples)
+            if "walk" in self.args.scenarios:
+                self.walk(generator, label)
+            if "generate" in self.args.scenarios:
+                self.generate(generator, label)
+
+    def walk(self, generator, label):
+        pick = generator._QADatasetGenerator__random_pick_entity
+        step = generator._QADatasetGenerator__random_walk
+        random.seed(self.args.seed)
+        deadline = Deadline()
+        start = time.perf_counter()
+        for _ in range(self.args.walks):
+            pick(deadline)
+        self.record("pick", label, time.perf_counter() - start, self.args.walks)
+
+        random.seed(self.args.seed)
+        entities = [pick(deadline) for _ in range(self.args.walks)]
+        start = time.perf_counter()
+        walked = 0
+        for entity in entities:
+            try:
+                step(entity, deadline)
+                walked += 1
+            except IndexError:
+                # dead end, counts as a walk all the same
+                walked += 1
+        self.record("walk", label, time.perf_counter() - start, walked)
+
+        # the same picks and steps drawn as one numpy batch of skeletons per category
+        for category in ["simple_1", "complex_1", "complex_2"]:
+            random.seed(self.args.seed)
+            with quiet():
+                generator.generate_batch(1, category)
+            start = time.perf_counter()
+            rows = sum(len(subjects) for (subjects, _, _) in generator.generate_batch(self.args.walks, category))
+            self.record("batch", label, time.perf_counter() - start, rows, category=category)
+
+    def generate(self, generator, label, requests = None):
+        for category, count in WORKLOADS:
+            random.seed(self.args.seed)
+            generator.reset_process_state()
+            before = requests() if requests is not None else None
+            start = time.perf_counter()
+            with quiet(not self.args.verbose):
+                questions, queries = generator.generate(self.args.amount, category, count, progress=False)
+            seconds = time.perf_counter() - start
+            extra = {"category": category, "count": count, "metrics": generator.metrics.to_dict()}
+            if requests is not None:
+                extra["sparql_requests"] = requests() - before
+            self.record("generate", label, seconds, len(queries), **extra)
+
+    def startup(self):
+        # fresh interpreters, best of a few runs, so earlier scenarios and disk caches do not count
+        commands = [
+            ("help", [sys.executable, os.path.join(ROOT, "dataset", "main.py"), "--help"]),
+            ("imports", [sys.executable, "-c", STARTUP_IMPORTS.format(path=os.path.join(ROOT, "dataset"), heavy=HEAVY_MODULES)]),
+        ]
+        for name, command in commands:
+            best, output = None, ""
+            for _ in range(self.args.startup_runs):
+                start = time.perf_counter()
+                done = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+                seconds = time.perf_counter() - start
+                if done.returncode != 0:
+                    self.failures.append(f"startup {name} exited with {done.returncode}: {done.stderr.strip()}")
+                    break
+                best, output = min(seconds, best or seconds), done.stdout
+            if best is None:
+                continue
+            extra = {}
+            if name == "imports":
+                extra["heavy_modules"] = output.split()
+                if extra["heavy_modules"]:
+                    self.failures.append(f"importing generator loads {', '.join(extra['heavy_modules'])}")
+            if best > self.args.max_startup:
+                self.failures.append(f"startup {name} took {best:.2f}s, more than {self.args.max_startup}s")
+            self.record("startup", name, best, **extra)
+
+    def run_remote(self):
+        path = ensure_graph(self.args.data_dir, self.args.remote_size, self.args.seed)
+        graph = Graph()
+        graph.parse(path)
+        with LocalEndpoint(graph, latency=self.args.endpoint_latency) as endpoint:
+            start = time.perf_counter()
+            generator = self.generator(endpoint.url)
+            self.record("load", f"remote_{self.args.remote_size}", time.perf_counter() - start, triples=self.args.remote_size)
+            self.generate(generator, f"remote_{self.args.remote_size}", requests=lambda: endpoint.requests)
+
+    def run(self):
+        if "startup" in self.args.scenarios:
+            self.startup()
+        for name, path, triples in self.graphs():
+            self.run_local(name, path, triples)
+        if "remote" in self.args.scenarios:
+            self.run_remote()
+        return {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(self.args),
+            "results": self.results,
+            "failures": self.failures,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the QA dataset generator with a stub LLM")
+    parser.add_argument('--output', type=str, default=None, help='JSON file for the results, stdout by default')
+    parser.add_argument('--scenarios', nargs='+', default=["startup", "walk", "generate", "remote"], choices=["startup", "walk", "generate", "remote"],
+                        help='Scenarios on top of graph loading')
+    parser.add_argument('--sizes', nargs='*', type=int, default=[10000, 100000, 1000000],
+                        help='Triples of the synthetic graphs, 10000000 works but needs several GB of memory')
+    parser.add_argument('--no-courses', action='store_true', help='Skip dataset/io/kg_courses.ttl')
+    parser.add_argument('--snapshot', action='store_true', help='Also benchmark the local graphs loaded from their binary snapshot')
+    parser.add_argument('--data-dir', type=str, default=os.path.join(ROOT, "benchmarks", "data"), help='Where synthetic graphs are kept')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic graphs and of the sampling')
+    parser.add_argument('--amount', type=int, default=50, help='Entries generated per category')
+    parser.add_argument('--walks', type=int, default=10000, help='Entity picks and random walk steps per graph')
+    parser.add_argument('--timeout', type=float, default=40, help='Time budget of one entry')
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='Seconds the stub LLM takes per request')
+    parser.add_argument('--llm-concurrency', type=int, default=4, help='Number of LLM requests in flight')
+    parser.add_argument('--llm-batch-size', type=int, default=1, help='Number of queries verbalized per LLM request')
+    parser.add_argument('--remote-size', type=int, default=10000, help='Triples served by the local SPARQL endpoint')
+    parser.add_argument('--endpoint-latency', type=float, default=0.0, help='Seconds the local SPARQL endpoint adds to every request')
+    parser.add_argument('--startup-runs', type=int, default=3, help='Fresh interpreters started per startup measurement')
+    parser.add_argument('--max-startup', type=float, default=1.0, help='Seconds main.py --help and importing the generator may take before the run fails')
+    parser.add_argument('--verbose', action='store_true', help='Keep the generator output')
+    args = parser.parse_args()
+
+    report = Benchmark(args).run()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Finished writing benchmark results to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=4))
+    for failure in report["failures"]:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    if report["failures"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import asyncio
+import hashlib
+import re
+import time
+
+class StubResponse:
+    def __init__(self, content):
+        self.content = content
+
+class StubChatModel:
+    # stands in for the HuggingFace chat model: same answer for the same prompt after a fixed latency
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        return StubResponse(self.answer(prompt))
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return StubResponse(self.answer(prompt))
+
+    def answer(self, prompt):
+        batch = re.match(r"Having (\d+) SPARQL queries", prompt)
+        if batch:
+            return "\n".join(f"{i}. {self.__question(prompt + str(i))}" for i in range(1, int(batch.group(1)) + 1))
+        return f'Here is the question: "{self.__question(prompt)}"'
+
+    def __question(self, prompt):
+        return f"What matches query {hashlib.blake2b(prompt.encode(), digest_size=6).hexdigest()}?"
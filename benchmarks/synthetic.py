@@ -0,0 +1,63 @@
+import os
+import random
+
+DBO = "http://dbpedia.org/ontology/"
+DBR = "http://dbpedia.org/resource/"
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+RDFS_LABEL = "http://www.w3.org/2000/01/rdf-schema#label"
+RDFS_RANGE = "http://www.w3.org/2000/01/rdf-schema#range"
+XSD_INTEGER = "http://www.w3.org/2001/XMLSchema#integer"
+# the classes of dataset/io/classes_allowed.txt, so the remote path can pick entities from them
+CLASSES = ["Airport", "Airline", "Country", "Book", "University"]
+RELATIONS = 20
+NUMBERS = 5
+
+def synthetic_path(directory: str, triples: int, seed: int = 0):
+    return os.path.join(directory, f"synthetic_{triples}_{seed}.nt")
+
+def _link(rng, entity, entities):
+    target = int(entities * rng.random() ** 2)
+    return f"{entity} <{DBO}rel{rng.randrange(RELATIONS)}> <{DBR}E{target}> ."
+
+def write_graph(path: str, triples: int, seed: int = 0):
+    # dbpedia-shaped n-triples, streamed so 10M triples never sit in memory
+    # every entity has a type, an english label, a numeric literal and a few links to other entities,
+    # link targets are skewed so some entities are hubs like in real KGs
+    rng = random.Random(seed)
+    entities = max(10, triples // 8)
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for j in range(RELATIONS):
+            f.write(f'<{DBO}rel{j}> <{RDFS_LABEL}> "relation {j}"@en .\n')
+        for j in range(NUMBERS):
+            f.write(f'<{DBO}num{j}> <{RDFS_LABEL}> "number {j}"@en .\n')
+            f.write(f"<{DBO}num{j}> <{RDFS_RANGE}> <{XSD_INTEGER}> .\n")
+        written += RELATIONS + 2 * NUMBERS
+        for i in range(entities):
+            if written >= triples:
+                break
+            e = f"<{DBR}E{i}>"
+            lines = [
+                f"{e} <{RDF_TYPE}> <{DBO}{CLASSES[i % len(CLASSES)]}> .",
+                f'{e} <{RDFS_LABEL}> "Entity {i}"@en .',
+                f'{e} <{DBO}num{rng.randrange(NUMBERS)}> "{rng.randrange(10000)}"^^<{XSD_INTEGER}> .',
+            ]
+            lines += [_link(rng, e, entities) for _ in range(rng.randint(2, 8))]
+            lines = lines[:triples - written]
+            f.write("\n".join(lines) + "\n")
+            written += len(lines)
+        # top up with more links when the entities came out short
+        while written < triples:
+            f.write(_link(rng, f"<{DBR}E{rng.randrange(entities)}>", entities) + "\n")
+            written += 1
+    return path
+
+def ensure_graph(directory: str, triples: int, seed: int = 0):
+    # generated once per size and seed, later runs reuse the file
+    path = synthetic_path(directory, triples, seed)
+    if not os.path.exists(path):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        write_graph(path + ".part", triples, seed)
+        os.replace(path + ".part", path)
+    return path
@@ -0,0 +1,150 @@
+import numpy as np
+from dedup import parse_query
+from sparql import SPARQLError
+from util import constant_ids
+
+# an answer is the sorted list of distinct ?x values, or the number of solutions for a count query;
+# an empty list or 0 means the query has no answer
+
+class LocalAnswers:
+    # evaluates generated queries as an indexed join over the integer edge arrays of a local index
+    def __init__(self, index, limit: int = 1000):
+        self.index = index
+        self.limit = limit
+        offsets, preds, objs, _, _ = index.edge_arrays()
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.preds = np.asarray(preds, dtype=np.int64)
+        self.objs = np.asarray(objs, dtype=np.int64)
+        n = len(self.offsets) - 1
+        self.subjects = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.offsets))
+        # the same edges grouped by object, for patterns whose object is known
+        order = np.argsort(self.objs, kind="stable")
+        self.rsubjects = self.subjects[order]
+        self.rpreds = self.preds[order]
+        self.roffsets = np.concatenate(([0], np.cumsum(np.bincount(self.objs, minlength=n)))).astype(np.int64)
+
+    def answer_many(self, queries, count: bool, timeout: float = None):
+        return [self.answer(query, count) for query in queries]
+
+    def answer(self, query: str, count: bool):
+        parsed = parse_query(query)
+        if parsed is None:
+            raise ValueError(f"Cannot evaluate {query}")
+        head, triples = parsed
+        target = next(t for t in head if t.startswith("?"))
+        solutions = self.__solve([[self.__resolve(term) for term in triple] for triple in triples])
+        if count:
+            return len(solutions)
+        values = {str(self.index.term(int(solution[target]))) for solution in solutions if target in solution}
+        return sorted(values)[:self.limit]
+
+    def __resolve(self, term):
+        # a variable name, or the ids a constant can match
+        if term.startswith("?"):
+            return term
+        return constant_ids(self.index, term)
+
+    def __solve(self, patterns):
+        solutions = [{}]
+        bound = set()
+        remaining = list(patterns)
+        while remaining and solutions:
+            # anchor every step on a constant or an already bound variable when there is one
+            anchored = lambda term: not isinstance(term, str) or term in bound
+            pattern = next((t for t in remaining if anchored(t[0]) or anchored(t[2])), remaining[0])
+            remaining.remove(pattern)
+            extended = []
+            for solution in solutions:
+                for s, o in self.__match(pattern, solution):
+                    extended_solution = self.__bind(solution, pattern, s, o)
+                    if extended_solution is not None:
+                        extended.append(extended_solution)
+            solutions = extended
+            bound.update(term for term in pattern if isinstance(term, str))
+        return solutions
+
+    def __bind(self, solution, pattern, s, o):
+        solution = dict(solution)
+        for term, value in ((pattern[0], s), (pattern[2], o)):
+            if isinstance(term, str):
+                if solution.get(term, value) != value:
+                    return None
+                solution[term] = value
+        return solution
+
+    def __values(self, term, solution):
+        if isinstance(term, str):
+            return [solution[term]] if term in solution else None
+        return term
+
+    def __match(self, pattern, solution):
+        s, p, o = (self.__values(term, solution) for term in pattern)
+        if p is None:
+            raise ValueError("Variable predicates are not supported")
+        if s is not None:
+            for subject in s:
+                start, end = self.offsets[subject], self.offsets[subject + 1]
+                mask = np.isin(self.preds[start:end], p)
+                if o is not None:
+                    mask &= np.isin(self.objs[start:end], o)
+                for obj in self.objs[start:end][mask]:
+                    yield subject, int(obj)
+        elif o is not None:
+            for obj in o:
+                start, end = self.roffsets[obj], self.roffsets[obj + 1]
+                for subject in self.rsubjects[start:end][np.isin(self.rpreds[start:end], p)]:
+                    yield int(subject), obj
+        else:
+            mask = np.isin(self.preds, p)
+            for subject, obj in zip(self.subjects[mask], self.objs[mask]):
+                yield int(subject), int(obj)
+
+class RemoteAnswers:
+    # evaluates many generated queries per request: each one becomes a UNION block tagged with a marker ?m
+    def __init__(self, select, batch_size: int = 20, limit: int = 1000, select_many = None):
+        self.select = select
+        self.select_many = select_many
+        self.batch_size = batch_size
+        self.limit = limit
+
+    def answer_many(self, queries, count: bool, timeout: float = None):
+        batches = [queries[i:i + self.batch_size] for i in range(0, len(queries), self.batch_size)]
+        results = None
+        if self.select_many is not None and len(batches) > 1:
+            try:
+                rows = self.select_many([self.__batch_query(batch, count) for batch in batches], timeout)
+                results = [self.__parse(batch_rows, len(batch), count) for batch_rows, batch in zip(rows, batches)]
+            except SPARQLError:
+                pass
+        if results is None:
+            results = [self.__answer_batch(batch, count, timeout) for batch in batches]
+        return [answer for batch in results for answer in batch]
+
+    def __answer_batch(self, batch, count, timeout):
+        try:
+            return self.__parse(self.select(self.__batch_query(batch, count), timeout), len(batch), count)
+        except SPARQLError:
+            if len(batch) == 1:
+                # the endpoint rejects the query itself, nothing to keep
+                return [0 if count else []]
+            # one bad block fails the whole request, find it by asking each query on its own
+            return [answer for query in batch for answer in self.__answer_batch([query], count, timeout)]
+
+    def __batch_query(self, batch, count):
+        blocks = []
+        for marker, query in enumerate(batch):
+            body = query[query.index("{") + 1:query.rindex("}")]
+            inner = f"select (count(?x) as ?cnt) {{ {body} }}" if count else f"select distinct ?x {{ {body} }} limit {self.limit}"
+            blocks.append(f"{{ {{ {inner} }} bind({marker} as ?m) }}")
+        union = "\n union \n".join(blocks)
+        return f"select ?m {'?cnt' if count else '?x'} {{\n{union}\n}}"
+
+    def __parse(self, rows, size, count):
+        answers = [0 if count else [] for _ in range(size)]
+        for row in rows:
+            marker = int(row['m']['value'])
+            if count:
+                answers[marker] = int(row['cnt']['value'])
+            else:
+                answers[marker].append(row['x']['value'])
+        return answers if count else [sorted(answer) for answer in answers]
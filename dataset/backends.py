@@ -0,0 +1,56 @@
+import asyncio
+import threading
+from verbalizer import Verbalizer
+from templates import TemplateVerbalizer
+
+BACKENDS = ("hf", "openai", "template")
+
+class ChatResponse:
+    def __init__(self, content: str):
+        self.content = content
+
+class OpenAICompatibleChat:
+    # chat completions of a locally hosted server (vllm, llama.cpp, tgi, ollama), same calls as a langchain chat model
+    def __init__(self, base_url: str, model: str, api_key: str = None, params: dict = None, timeout: float = 60):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.api_key = api_key
+        self.params = params or {}
+        self.timeout = timeout
+        # sessions are not shared between threads, ainvoke runs every call on a pool thread
+        self.local = threading.local()
+
+    def __session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            import requests
+            session = requests.Session()
+            if self.api_key:
+                session.headers["Authorization"] = f"Bearer {self.api_key}"
+            self.local.session = session
+        return session
+
+    def invoke(self, prompt: str):
+        payload = {"model": self.model, "messages": [{"role": "user", "content": prompt}], **self.params}
+        response = self.__session().post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return ChatResponse(response.json()["choices"][0]["message"]["content"])
+
+    async def ainvoke(self, prompt: str):
+        return await asyncio.to_thread(self.invoke, prompt)
+
+def build_verbalizer(backend: str = "hf", backend_options: dict = None, **options):
+    # backend_options configure the chat model, options the Verbalizer around it; a worker rebuilds its
+    # verbalizer from the config of the parent's one through here
+    backend_options = backend_options or {}
+    if backend == "template":
+        return TemplateVerbalizer(chunk_size=options.get("chunk_size", 256), metrics=options.get("metrics"))
+    options.pop("chunk_size", None)
+    if backend == "hf":
+        return Verbalizer(backend=backend, **options)
+    if backend == "openai":
+        chat_model = OpenAICompatibleChat(backend_options["base_url"], backend_options["model"], backend_options.get("api_key"),
+                                          backend_options.get("params"), options.get("timeout", 60))
+        return Verbalizer(chat_model, model_id=backend_options["model"], model_params=backend_options.get("params"),
+                          backend=backend, backend_options=backend_options, **options)
+    raise ValueError(f"Unknown verbalizer backend {backend}, expected one of {', '.join(BACKENDS)}")
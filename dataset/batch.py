@@ -0,0 +1,40 @@
+import numpy as np
+
+class BatchSampler:
+    # draws whole batches of skeletons at once from the integer csr view of a local index, the same
+    # distributions as the per-entry walk: a typed start uniformly among those that can hold the pattern,
+    # then its edges uniformly; rows are term ids, the generator turns them into queries
+    def __init__(self, index):
+        self.index = index
+        offsets, preds, objs, is_literal, typed = index.edge_arrays()
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.preds = np.asarray(preds, dtype=np.int64)
+        self.objs = np.asarray(objs, dtype=np.int64)
+        self.is_literal = np.asarray(is_literal, dtype=np.bool_)
+        self.degree = np.diff(self.offsets)
+        self.typed = np.asarray(typed, dtype=np.int64)
+        # typed entities with at least k edges, per k
+        self.starts = {}
+
+    def __starts(self, k):
+        if k not in self.starts:
+            self.starts[k] = self.typed[self.degree[self.typed] >= k]
+        if len(self.starts[k]) == 0:
+            raise LookupError(f"No typed entity with {k} usable edges")
+        return self.starts[k]
+
+    def stars(self, n: int, k: int, rng):
+        # n subjects with k distinct edges each as (subjects, preds, objs) of shape (n, k): one edge is the
+        # triple of a simple entry, several the ?x p1 o1 . ?x p2 o2 shape of complex_1
+        starts = self.__starts(k)
+        subjects = starts[rng.integers(0, len(starts), n)]
+        degree = self.degree[subjects]
+        picks = np.empty((n, k), dtype=np.int64)
+        for j in range(k):
+            # a draw among the degree - j edges left, shifted past the ones already taken in ascending order
+            pick = rng.integers(0, degree - j)
+            for taken in np.sort(picks[:, :j], axis=1).T:
+                pick += pick >= taken
+            picks[:, j] = pick
+        edges = self.offsets[subjects][:, None] + picks
+        return np.repeat(subjects[:, None], k, axis=1), self.preds[edges], self.objs[edges]
@@ -0,0 +1,137 @@
+import copy
+import functools
+import hashlib
+import math
+import re
+
+PREFIXES = {
+    "wd:": "http://www.wikidata.org/entity/",
+    "wdt:": "http://www.wikidata.org/prop/direct/",
+    "dbc:": "http://dbpedia.org/resource/Category:",
+    "dbd:": "http://dbpedia.org/datatype/",
+    "dbo:": "http://dbpedia.org/ontology/",
+    "dbr:": "http://dbpedia.org/resource/",
+    "dbp:": "http://dbpedia.org/property/",
+    "xsd:": "http://www.w3.org/2001/XMLSchema#",
+    "rdf:": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "rdfs:": "http://www.w3.org/2000/01/rdf-schema#",
+}
+
+TOKEN = re.compile(r"""<[^>\s]*>|'(?:[^'\\]|\\.)*'(?:\^\^(?:<[^>]*>|[\w-]*:[\w-]*)|@[\w-]+)?|"(?:[^"\\]|\\.)*"(?:\^\^(?:<[^>]*>|[\w-]*:[\w-]*)|@[\w-]+)?|\?\w+|[{}().]|[^\s{}()]+""")
+
+class DuplicateQueryError(Exception):
+    pass
+
+def _expand(term):
+    for prefix, namespace in PREFIXES.items():
+        if term.startswith(prefix):
+            return f"<{namespace}{term[len(prefix):]}>"
+    return term
+
+def _normalize_term(term):
+    if term[0] in "'\"":
+        # 'a' and "a" are the same literal, only the suffix after the closing quote matters
+        quote = term[0]
+        end = term.rindex(quote)
+        value, suffix = term[1:end], term[end + 1:]
+        if suffix.startswith("^^"):
+            suffix = "^^" + _expand(suffix[2:])
+        return '"' + value.replace('"', '\\"') + '"' + suffix
+    if term.startswith("?") or term.startswith("<"):
+        return term
+    return _expand(term)
+
+def parse_query(query: str):
+    # head tokens and triple patterns of a generated query, terms as full iris and double-quoted literals
+    tokens = TOKEN.findall(query)
+    if "{" not in tokens or "}" not in tokens:
+        return None
+    start = tokens.index("{")
+    end = len(tokens) - 1 - tokens[::-1].index("}")
+    head, body = [t.lower() if not t.startswith("?") else t for t in tokens[:start]], tokens[start + 1:end]
+
+    triples, current = [], []
+    for token in body:
+        if token == ".":
+            if current:
+                triples.append(current)
+            current = []
+        else:
+            current.append(_normalize_term(token))
+    if current:
+        triples.append(current)
+    return head, triples
+
+def canonical_query(query: str):
+    # same string for queries that differ only in triple order, variable names or prefix vs full iri
+    parsed = parse_query(query)
+    if parsed is None:
+        return " ".join(TOKEN.findall(query))
+    head, triples = parsed
+
+    # name variables by walking out from the projected ones, so a chain gets the same names in any order
+    names = {}
+    for token in head:
+        if token.startswith("?") and token not in names:
+            names[token] = f"?v{len(names)}"
+    render = lambda triple: " ".join(names.get(t, "?_" if t.startswith("?") else t) for t in triple)
+    pending = [t for t in triples if any(term.startswith("?") and term not in names for term in t)]
+    while pending:
+        connected = [t for t in pending if any(term in names for term in t)] or pending
+        triple = min(connected, key=render)
+        for term in triple:
+            if term.startswith("?") and term not in names:
+                names[term] = f"?v{len(names)}"
+        pending = [t for t in pending if any(term.startswith("?") and term not in names for term in t)]
+
+    head = [names.get(t, t) for t in head]
+    return " ".join(head) + " { " + " . ".join(sorted(render(t) for t in triples)) + " . }"
+
+# a query is checked against the run, claimed for its chunk and added once verbalized, hashed only the first time
+@functools.lru_cache(maxsize=8192)
+def query_key(query: str):
+    return hashlib.blake2b(canonical_query(query).encode("utf-8"), digest_size=16).digest()
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 1e-4):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def __positions(self, key):
+        # double hashing over the two halves of the digest
+        h1, h2 = int.from_bytes(key[:8], "little"), int.from_bytes(key[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[i >> 3] & (1 << (i & 7)) for i in self.__positions(key))
+
+    def add(self, key):
+        for i in self.__positions(key):
+            self.bits[i >> 3] |= 1 << (i & 7)
+
+class Deduplicator:
+    # hashes of canonical queries, or a bloom filter when the run is too large to keep them all
+    def __init__(self, bloom_capacity: int = None, error_rate: float = 1e-4):
+        self.keys = BloomFilter(bloom_capacity, error_rate) if bloom_capacity else set()
+        self.count = 0
+
+    def __contains__(self, query):
+        return query_key(query) in self.keys
+
+    def __len__(self):
+        return self.count
+
+    def copy(self):
+        # an independent deduplicator holding the same queries
+        other = copy.copy(self)
+        other.keys = copy.deepcopy(self.keys)
+        return other
+
+    def add(self, query):
+        key = query_key(query)
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        self.count += 1
+        return True
@@ -0,0 +1,103 @@
+from collections import Counter, OrderedDict, deque
+from metrics import Metrics
+
+# what a dead end is: the entity has no usable edge, no edge to another entity a chain could follow, no english
+# label, the property has no rdfs:range for its literals, the class has no instance to start from
+KINDS = {
+    "entity": "entities without usable edges",
+    "hop": "entities without edges to entities",
+    "label": "entities without labels",
+    "range": "properties without range",
+    "class": "classes without instances",
+}
+
+class SamplingStalled(Exception):
+    pass
+
+class CapacityExceeded(ValueError):
+    # more entries requested than the profiled graph has distinct queries for
+    pass
+
+class DeadEnds:
+    # bounded negative cache of (kind, key) dead ends, the oldest ones are forgotten first
+    def __init__(self, size: int = 100000, metrics: Metrics = None):
+        self.size = size
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.keys = {kind: OrderedDict() for kind in KINDS}
+
+    def __contains__(self, item):
+        kind, key = item
+        return key in self.keys[kind]
+
+    def add(self, kind, key):
+        keys = self.keys[kind]
+        if key in keys:
+            return
+        keys[key] = True
+        self.metrics.count(f"dead_ends.{kind}")
+        if len(keys) > self.size:
+            keys.popitem(last=False)
+
+    def summary(self):
+        return ", ".join(f"{len(keys)} {KINDS[kind]}" for kind, keys in self.keys.items() if keys)
+
+class RetryScheduler:
+    # outcome of every sampling attempt per category: a skeleton, or the reason it was dropped; a skeleton dropped
+    # later, e.g. as an empty answer or a duplicate of another worker, adds that reason as well. A category whose
+    # last max_attempts outcomes all failed, or whose acceptance rate over the last window outcomes fell below
+    # min_rate, stalls instead of sampling forever
+    def __init__(self, max_attempts: int = 1000, window: int = 10000, min_rate: float = 0.001, dead_ends: DeadEnds = None):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.min_rate = min_rate
+        self.dead_ends = dead_ends
+        self.outcomes = {}
+        self.streaks = {}
+        # accepted outcomes in the window, kept up to date so check() does not scan it
+        self.accepted = {}
+
+    def reset(self, category):
+        self.outcomes.pop(category, None)
+        self.streaks.pop(category, None)
+        self.accepted.pop(category, None)
+
+    def __record(self, category, reason):
+        if category not in self.outcomes:
+            self.outcomes[category] = deque(maxlen=self.window or None)
+            self.accepted[category] = 0
+        outcomes = self.outcomes[category]
+        if len(outcomes) == outcomes.maxlen and outcomes[0] is None:
+            # the append below evicts an accepted outcome
+            self.accepted[category] -= 1
+        outcomes.append(reason)
+        if reason is None:
+            self.accepted[category] += 1
+
+    def accept(self, category):
+        self.__record(category, None)
+        self.streaks[category] = 0
+
+    def reject(self, category, reason, n: int = 1):
+        for _ in range(n):
+            self.__record(category, reason)
+        self.streaks[category] = self.streaks.get(category, 0) + n
+
+    def rate(self, category):
+        outcomes = self.outcomes.get(category)
+        if not outcomes:
+            return None
+        return self.accepted[category] / len(outcomes)
+
+    def check(self, category):
+        streak = self.streaks.get(category, 0)
+        if self.max_attempts and streak >= self.max_attempts:
+            raise SamplingStalled(self.diagnose(category, f"{streak} attempts in a row failed"))
+        outcomes = self.outcomes.get(category, ())
+        if self.window and self.min_rate and len(outcomes) >= self.window and self.rate(category) < self.min_rate:
+            raise SamplingStalled(self.diagnose(category, f"acceptance rate {self.rate(category):.1%} over the last {len(outcomes)} attempts"))
+
+    def diagnose(self, category, cause):
+        reasons = Counter(reason for reason in self.outcomes.get(category, ()) if reason is not None)
+        top = ", ".join(f"{reason} {n}" for reason, n in reasons.most_common(3))
+        known = self.dead_ends.summary() if self.dead_ends is not None else ""
+        return f"{category}: {cause} (most frequent: {top or 'none'}; known dead ends: {known or 'none'})"
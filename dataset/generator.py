@@ -1,91 +1,588 @@
 import warnings
-from util import get_next_variable, is_dbpedia_entity_iri, is_wikidata_entity_iri, replace_prefix_dbpedia, replace_prefix_wikidata
-from llm import chat_model
+from util import get_next_variable, is_dbpedia_entity_iri, is_wikidata_entity_iri, replace_prefix_dbpedia, replace_prefix_wikidata, to_count_query
+from util import is_acceptable_dbpedia_edge, is_acceptable_wikidata_edge, is_literal
 from typing import List
 import validators
-from SPARQLWrapper import SPARQLWrapper, JSON
-from rdflib import Graph
-from rdflib.namespace import RDF
+from pool import EntityPool
+from labels import LabelCache
+from neighborhood import NeighborhoodCache
+from verbalizer import Verbalizer
+from parallel import iter_parallel
+from dedup import Deduplicator, DuplicateQueryError
+from failures import CapacityExceeded, DeadEnds, RetryScheduler, SamplingStalled
+from schema import SchemaCache, typed_literal
+from output import JsonlWriter, compact_jsonl, read_jsonl
 import random
-from rdflib import Literal
 import re
 from tqdm import tqdm
-from timeout import timeout
-import pandas as pd
+from timeout import Deadline
+from metrics import Metrics, timed
 import os
 
+# rdflib, numpy and pandas are imported where a local source, validation or json output needs them,
+# so a remote run, a worker process or --help does not pay for them
+
 warnings.filterwarnings("ignore")
 
 class QADatasetGenerator:
-  def __init__(self, source: str, excluded_props: List[str], timeout = 40, classes_file: str = "dataset\io\classes_allowed.txt"):
+  def __init__(self, source: str, excluded_props: List[str], timeout: float = 40, classes_file: str = "dataset\io\classes_allowed.txt",
+               label_cache: str = os.path.join("dataset", "io", "cache", "labels.sqlite"), verbalizer: Verbalizer = None,
+               dedup_bloom: int = None, snapshot: bool = False, sparql_connections: int = 8, sparql_rate: float = None,
+               stage_budgets: dict = None, metrics_every: float = None, validate: bool = False, answer_limit: int = 1000,
+               store: bool = False, store_memory: int = 512, prefetch_batch: int = 50, stats: str = None,
+               max_attempts: int = 1000, min_acceptance: float = 0.001, acceptance_window: int = 10000, dead_ends: int = 100000,
+               schema_cache: str = os.path.join("dataset", "io", "cache", "schema.sqlite")):
     self.source = source
+    self.metrics_every = metrics_every
+    self.metrics = Metrics(metrics_every)
     self.is_api = validators.url(source)
     self.excluded_props = excluded_props
-    self.wrapper = None if not self.is_api else SPARQLWrapper(self.source,
-                   agent="Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.11 (KHTML, like Gecko) Chrome/23.0.1271.64 Safari/537.11")
+    self.sparql_connections = sparql_connections
+    self.sparql_rate = sparql_rate
+    # remote neighborhoods are prefetched this many per request in the background, 0 fetches them only on demand
+    self.prefetch_batch = prefetch_batch
+    self.client = None if not self.is_api else self.__new_client()
+    # timeout is the budget of one entry up to verbalization, stage_budgets can cap
+    # 'sampling', 'labels' and 'llm' (the llm one starts when the chunk is verbalized)
     self.timeout = timeout
+    self.stage_budgets = stage_budgets or {}
+    # known dead ends are skipped by the walk, a category that stops producing entries stalls with a diagnostic
+    self.max_attempts = max_attempts
+    self.min_acceptance = min_acceptance
+    self.acceptance_window = acceptance_window
+    self.dead_end_size = dead_ends
+    self.dead_ends = DeadEnds(dead_ends, self.metrics)
+    self.scheduler = RetryScheduler(max_attempts, acceptance_window, min_acceptance, self.dead_ends)
+    self.stalled = None
+    # outputs written with fewer entries than requested, as (path, written, amount, why)
+    self.shortfalls = []
+    # ranges and labels of remote properties, bulk loaded on first use and kept on disk per endpoint
+    self.schema_cache = schema_cache
+    self.schema = None
     self.classes_file = classes_file
+    self.classes = []
+    self.class_sizes = {}
+    self.pools = {}
+    # profile written by main.py profile: instances per class, and how many distinct queries every category has
+    self.stats_path = stats
+    self.stats = None
+    if stats:
+      from kgprofile import load_stats
+      self.stats = load_stats(stats, None if self.is_api else source, excluded_props)
+    self.labels = None
+    self.label_cache = label_cache
+    self.verbalizer = verbalizer if verbalizer is not None else Verbalizer()
+    self.verbalizer.metrics = self.metrics
+    # accepted queries of the running generation and the ones sampled for the current chunk
+    self.dedup_bloom = dedup_bloom
+    self.seen = self.new_deduplicator()
+    self.claimed = Deduplicator()
+    # count skeletons derived from sampled simple ones, per category, see share_counts
+    self.shared = {}
     self.graph = None
+    self.index = None
+    self.paths = None
+    self.batch = None
+    # with validate every candidate query is run before the llm, empty ones are dropped and the answer is kept
+    self.validate = validate
+    self.answer_limit = answer_limit
+    self.answers = None
+    self.neighborhoods = None
+    self.snapshot = snapshot
+    # store keeps a local graph on disk in sqlite, for graphs larger than memory
+    self.store = store
+    self.store_memory = store_memory
     if not self.is_api:
-      self.graph = Graph()
-      self.graph.parse(source)
+      if store:
+        from store import load_store
+        self.index = load_store(source, excluded_props, memory_mb=store_memory)
+      elif snapshot:
+        # memory-mapped, rebuilt only when the source changed
+        from snapshot import load_snapshot
+        self.index = load_snapshot(source, excluded_props)
+      else:
+        from rdflib import Graph
+        from index import GraphIndex
+        self.graph = Graph()
+        self.graph.parse(source)
+        self.index = GraphIndex(self.graph, excluded_props)
+    else:
+      self.classes = self.__load_classes()
+      if self.stats is not None:
+        self.class_sizes = self.__class_sizes()
+      self.labels = LabelCache(self.__select, label_cache, select_many=self.__select_many, metrics=self.metrics)
+      self.neighborhoods = self.__new_neighborhood_cache()
+
+  def __new_client(self, workers: int = 1):
+    from sparql import SPARQLClient
+    # --sparql-rate is for the whole run, the processes sharing the endpoint each get their part of it
+    rate = self.sparql_rate / workers if self.sparql_rate else None
+    return SPARQLClient(self.source, connections=self.sparql_connections, rate=rate, metrics=self.metrics)
+
+  def __property_schema(self):
+    # only dbpedia declares rdfs:range, wikidata literals are typed from their value
+    if self.schema is None and self.is_api and "dbpedia" in self.source:
+      self.schema = SchemaCache(self.__select, self.source, self.schema_cache, metrics=self.metrics)
+    return self.schema
+
+  def __new_neighborhood_cache(self):
+    accept = is_acceptable_wikidata_edge if "wikidata" in self.source else is_acceptable_dbpedia_edge
+    hop = is_wikidata_entity_iri if "wikidata" in self.source else is_dbpedia_entity_iri
+    fetch_many = self.__fetch_neighborhoods if self.prefetch_batch > 0 else None
+    return NeighborhoodCache(self.__fetch_neighborhood, accept, metrics=self.metrics, fetch_many=fetch_many, hop=hop,
+                             batch_size=max(self.prefetch_batch, 1))
+
+  @property
+  def config(self):
+    # everything a spawned worker needs to build an equivalent generator
+    return {
+      "source": self.source,
+      "excluded_props": self.excluded_props,
+      "timeout": self.timeout,
+      "stage_budgets": self.stage_budgets,
+      "classes_file": self.classes_file,
+      "label_cache": self.label_cache,
+      "schema_cache": self.schema_cache,
+      "dedup_bloom": self.dedup_bloom,
+      "snapshot": self.snapshot,
+      "store": self.store,
+      "store_memory": self.store_memory,
+      "sparql_connections": self.sparql_connections,
+      "sparql_rate": self.sparql_rate,
+      "prefetch_batch": self.prefetch_batch,
+      "stats": self.stats_path,
+      "max_attempts": self.max_attempts,
+      "min_acceptance": self.min_acceptance,
+      "acceptance_window": self.acceptance_window,
+      "dead_ends": self.dead_end_size,
+      "metrics_every": self.metrics_every,
+      "validate": self.validate,
+      "answer_limit": self.answer_limit,
+      "verbalizer": self.verbalizer.config,
+    }
+
+  def reset_process_state(self, workers: int = 1):
+    # called in a forked worker: locks, pool threads, sockets and sqlite handles do not survive fork
+    # the worker records into its own metrics and hands them back with every shard
+    self.metrics = Metrics()
+    self.verbalizer.metrics = self.metrics
+    self.dead_ends.metrics = self.metrics
+    if self.client is not None:
+      # every worker gets its own bucket, so split the rate between them
+      self.client = self.__new_client(workers)
+    self.pools = {}
+    if self.labels is not None:
+      self.labels = LabelCache(self.__select, self.label_cache, select_many=self.__select_many, metrics=self.metrics)
+    # read again from its sqlite file on first use
+    self.schema = None
+    if self.neighborhoods is not None:
+      self.neighborhoods.close()
+      self.neighborhoods = self.__new_neighborhood_cache()
+    if self.is_api:
+      self.answers = None
 
-  def write_to_file(self, dataset_name: str, amount: int, category: str, count: bool):
+  def write_to_file(self, dataset_name: str, amount: int, category: str, count: bool, workers: int = 1, seed: int = None,
+                    stream: bool = False, resume: bool = False):
     # count can be used with simple only
     if count and category.startswith("complex"):
       raise ValueError("Count for complex queries is not supported")
-    
-    questions, queries = self.generate(amount, category, count)
-    df = {
-      "question": questions,
-      "query": queries
-    }
-    df = pd.DataFrame(df)
-    status = "count" if count else "normal"
+    # before an earlier output is removed or resumed
+    self.check_capacity(amount, category, count)
 
-    directory = f'dataset\io\{dataset_name}'
+    status = "count" if count else "normal"
+    directory = os.path.join("dataset", "io", dataset_name)
     if not os.path.exists(directory):
       os.makedirs(directory)
+    path = os.path.join(directory, f"{category}_{amount}_{status}")
+
+    if not stream and not resume:
+      questions, queries, answers = [], [], []
+      for question, query, answer in self.iter_entries(amount, category, count, workers, seed):
+        questions.append(question)
+        queries.append(query)
+        answers.append(answer)
+      df = {
+        "question": questions,
+        "query": queries
+      }
+      if self.validate:
+        df["answer"] = answers
+      import pandas as pd
+      df = pd.DataFrame(df)
+      df.to_json(f"{path}.json", orient='records', indent=4)
+      self.__finish(f"{path}.json", category, len(queries), amount)
+      return
 
-    df.to_json(f'{directory}\{category}_{amount}_{status}.json', orient='records', indent=4)
-    print("Finished writing dataset")
+    # every accepted entry goes to disk right away, the json is compacted from it at the end
+    seen = self.new_deduplicator()
+    resumed = 0
+    if resume:
+      # only the queries are kept, as dedup keys
+      for entry in read_jsonl(f"{path}.jsonl"):
+        seen.add(entry["query"])
+        resumed += 1
+      print(f"Resuming after {resumed} entries")
+    elif os.path.exists(f"{path}.jsonl"):
+      os.remove(f"{path}.jsonl")
+    writer = JsonlWriter(f"{path}.jsonl")
+    written = resumed
+    try:
+      for question, query, answer in self.iter_entries(amount - resumed, category, count, workers, seed, seen):
+        entry = {"question": question, "query": query}
+        if self.validate:
+          entry["answer"] = answer
+        writer.write(entry)
+        written += 1
+    finally:
+      writer.close()
+    compact_jsonl(f"{path}.jsonl", f"{path}.json")
+    self.__finish(f"{path}.json", category, written, amount)
+
+  def __finish(self, path: str, category: str, written: int, amount: int):
+    # the file name promises amount entries, a stalled category leaves it short: said loudly and remembered,
+    # main exits with an error for it and --resume can pick it up later
+    if written >= amount:
+      print("Finished writing dataset")
+      return
+    self.metrics.count(f"{category}.shortfall", amount - written)
+    self.shortfalls.append((path, written, amount, self.stalled))
+    print(f"Wrote only {written} of {amount} entries to {path}: {self.stalled}")
+
+  def write_jobs(self, dataset_name: str, targets: List[dict], workers: int = 1, seed: int = None,
+                 stream: bool = False, resume: bool = False):
+    # every target of a job spec in this process: the graph, entity pools and label caches stay warm between them
+    # normal targets run first so count targets of the same category can reuse their skeletons
+    targets = sorted(targets, key=lambda target: target["count"])
+    # every target is checked before the first one starts, each is its own file with its own duplicates
+    for target in targets:
+      self.check_capacity(target["amount"], target["category"], target["count"])
+    if workers <= 1 and seed is None:
+      normal = {target["category"] for target in targets if not target["count"]}
+      for target in targets:
+        if target["count"] and target["category"] in normal:
+          self.share_counts(target["category"], target["amount"])
+    try:
+      for target in targets:
+        print(f"Generating {target['amount']} {target['category']}{' count' if target['count'] else ''} entries")
+        self.write_to_file(dataset_name, target["amount"], target["category"], target["count"], workers, seed, stream, resume)
+    finally:
+      self.shared = {}
 
-    
-  def generate(self, amount: int, category: str, count: bool):
+  def share_counts(self, category: str, amount: int):
+    # simple skeletons sampled from now on are also kept as count skeletons, up to amount of them;
+    # only the serial path shares, skeletons of worker processes stay there
+    shared = self.shared.setdefault(category, {"wanted": 0, "skeletons": []})
+    shared["wanted"] += amount
+
+  def __share(self, category, count, skeletons):
+    shared = self.shared.get(category)
+    if count or shared is None:
+      return
+    for (mapping, query, _) in skeletons:
+      if len(shared["skeletons"]) >= shared["wanted"]:
+        return
+      shared["skeletons"].append((mapping, to_count_query(query)))
+
+  def __take_shared(self, category, count, amount):
+    shared = self.shared.get(category)
+    if not count or shared is None:
+      return []
+    taken, shared["skeletons"] = shared["skeletons"][:amount], shared["skeletons"][amount:]
+    shared["wanted"] -= len(taken)
+    self.metrics.count(f"{category}.shared", len(taken))
+    return taken
+
+  def check_capacity(self, amount: int, category: str, count: bool):
+    # stops a run the profiled graph cannot fill before it spins on duplicates
+    if self.stats is None:
+      return
+    capacity = self.stats["capacity"].get(category)
+    if capacity is not None and amount > capacity:
+      status = "count" if count else "normal"
+      raise CapacityExceeded(f"{amount} {category} {status} entries requested, but {self.stats['source']} has at most {capacity} "
+                       f"distinct {category} queries according to {self.stats_path}")
+
+  def iter_entries(self, amount: int, category: str, count: bool, workers: int = 1, seed: int = None, seen: Deduplicator = None):
+    self.check_capacity(amount + (len(seen) if seen is not None else 0), category, count)
+    if category == "complex_2" and not self.is_api:
+      # built before forking so the workers share it
+      self.path_index()
+    if self.validate:
+      self.answer_index()
+    # acceptance is judged per run, a stalled target does not stall the next one of the same category
+    self.scheduler.reset(category)
+    if workers > 1 or seed is not None:
+      entries = iter_parallel(self, amount, category, count, workers, seed=seed if seed is not None else 0, seen=seen)
+    else:
+      entries = self.iter_generate(amount, category, count, seen=seen)
+    # only entries that made it into the output count as accepted
+    for entry in entries:
+      self.metrics.count(f"{category}.accepted")
+      self.metrics.report()
+      yield entry
+    self.metrics.report(force=self.metrics_every is not None)
+
+  def generate(self, amount: int, category: str, count: bool, progress: bool = True):
     questions = []
     queries = []
-    for _ in tqdm(range(amount)):
-      while True:
-        try:
-          with timeout(self.timeout):
-            cat = category.split("_")
-            question, query = "", ""
-            if cat[0] == "simple":
-              if count:
-                question, query = self.generate_count(cat[1])
-              else:
-                question, query = self.generate_simple(cat[1])
-              break
-            elif cat[0] == "complex":
-              question, query = self.generate_complex(cat[1])
-              break
-            if query in queries:
-              raise ValueError()
-        except TimeoutError:
-          print("Timeout, repeating")
-          continue
-        except ValueError:
-          print("Duplicate query, repeating")
-          continue
-        except Exception as e:
-          print(f"Error: {e}")
-          continue
-      question, query = question.strip(), query.strip()
+    for question, query, _ in self.iter_generate(amount, category, count, progress=progress):
       questions.append(question)
       queries.append(query)
     return questions, queries
 
-  def __refine_question(self, mapping, query):
+  def iter_generate(self, amount: int, category: str, count: bool, seen: Deduplicator = None, progress: bool = True):
+    # yields entries as soon as they are verbalized, queries in seen are never produced again
+    seen = seen if seen is not None else self.new_deduplicator()
+    self.seen = seen
+    initial = len(seen)
+    produced = 0
+    progress = tqdm(total=initial + amount, initial=initial, disable=not progress)
+    self.stalled = None
+    # skeletons whose verbalization timed out get one more chance instead of being thrown away
+    retry = []
+    try:
+      while produced < amount:
+        self.scheduler.check(category)
+        # sample a chunk of skeletons, then verbalize the whole chunk concurrently
+        size = min(self.verbalizer.chunk_size, amount - produced)
+        retried, retry = retry[:size], retry[size:]
+        fresh, stalled = self.sample_chunk(size - len(retried), category, count)
+        entries, failed = self.verbalize_chunk(retried + fresh, category, seen, retried)
+        retry += failed
+        for entry in entries:
+          produced += 1
+          progress.update(1)
+          yield entry
+        if stalled is not None:
+          raise stalled
+    except SamplingStalled as e:
+      # what was produced so far is kept, the caller writes a partial result
+      self.stalled = str(e)
+      self.metrics.count(f"{category}.stalled")
+      print(f"Stopping after {produced} of {amount} entries, sampling stalled: {e}")
+    progress.close()
+
+  def sample_chunk(self, size: int, category: str, count: bool):
+    # up to size validated (mapping, query, answer) skeletons whose queries are new to self.seen and to each other,
+    # and the SamplingStalled that cut the chunk short, if any
+    self.claimed = Deduplicator()
+    fresh = self.__take_shared(category, count, size)
+    if self.batch_sampler() is not None:
+      fresh += self.__sample_batch(size - len(fresh), category, count)
+    # whatever the batch could not fill, a remote source or the sqlite store samples one at a time;
+    # a chunk that stalls halfway is still verbalized
+    stalled = None
+    while len(fresh) < size and stalled is None:
+      try:
+        fresh.append(self.__sample_skeleton(category, count))
+      except SamplingStalled as e:
+        stalled = e
+    skeletons = self.__validate(fresh, category, count)
+    self.__share(category, count, skeletons)
+    return skeletons, stalled
+
+  def verbalize_chunk(self, skeletons, category: str, seen: Deduplicator, retried = ()):
+    # the (question, query, answer) entries of the skeletons that were verbalized and are new to seen, which takes
+    # them; and the skeletons whose verbalization failed for the first time, those in retried are dropped
+    items = [(query, self.__describe_mapping(mapping, query)) for (mapping, query, _) in skeletons]
+    deadlines = [Deadline(self.stage_budgets.get("llm")) for _ in items]
+    with self.metrics.time("verbalize_chunk"):
+      questions = self.verbalizer.verbalize_many(items, deadlines)
+    entries, failed = [], []
+    for skeleton, question in zip(skeletons, questions):
+      query = skeleton[1]
+      if question is None:
+        self.metrics.count(f"{category}.llm_failures")
+        if skeleton not in retried:
+          failed.append(skeleton)
+        else:
+          self.scheduler.reject(category, "llm")
+        print("Verbalization failed, repeating")
+        continue
+      query = query.strip()
+      if not seen.add(query):
+        self.metrics.count(f"{category}.duplicates")
+        self.scheduler.reject(category, "duplicate")
+        print("Duplicate query, repeating")
+        continue
+      entries.append((question.strip(), query, skeleton[2]))
+    return entries, failed
+
+  @timed("sample")
+  def __sample_skeleton(self, category: str, count: bool):
+    # retried until one works, unless the scheduler sees the category stall
+    while True:
+      self.scheduler.check(category)
+      try:
+        deadline = Deadline(self.timeout)
+        cat = category.split("_")
+        if cat[0] == "simple":
+          if count:
+            skeleton = self.generate_count(cat[1], return_question=False, deadline=deadline)
+          else:
+            skeleton = self.generate_simple(cat[1], return_question=False, deadline=deadline)
+        elif cat[0] == "complex":
+          skeleton = self.generate_complex(cat[1], return_question=False, deadline=deadline)
+        else:
+          raise ValueError(f"Unknown category {category}")
+        self.scheduler.accept(category)
+        return skeleton
+      except TimeoutError:
+        self.metrics.count(f"{category}.timeouts")
+        self.scheduler.reject(category, "timeout")
+        print("Timeout, repeating")
+      except DuplicateQueryError:
+        self.metrics.count(f"{category}.duplicates")
+        self.scheduler.reject(category, "duplicate")
+        print("Duplicate query, repeating")
+      except SamplingStalled:
+        raise
+      except Exception as e:
+        self.metrics.count(f"{category}.errors")
+        self.scheduler.reject(category, type(e).__name__)
+        print(f"Error: {e}")
+
+  def batch_sampler(self):
+    # None where there is no integer view of the graph to draw from: remote sources and the sqlite store
+    if self.batch is None and not self.is_api and not self.store:
+      from batch import BatchSampler
+      self.batch = BatchSampler(self.index)
+    return self.batch
+
+  def generate_batch(self, amount: int, category: str, max_triples: int = 3, rng = None):
+    # the starts, edges and chains of amount skeletons in one numpy draw, as (subjects, preds, objs) term id arrays
+    # of shape (rows, triples), one group per number of triples; same distributions as the per-entry walk
+    import numpy as np
+    if self.batch_sampler() is None:
+      raise ValueError("Batch sampling needs a local graph held in memory or in a snapshot")
+    rng = rng if rng is not None else np.random.default_rng(random.getrandbits(64))
+    kind, variant = category.split("_")
+    if kind == "simple":
+      return [self.batch.stars(amount, 1, rng)]
+    # the depth is drawn per entry as in generate_complex, the rows of one depth are drawn together
+    depths = rng.integers(2, max_triples, amount)
+    batches = []
+    for depth in np.unique(depths).tolist():
+      n = int((depths == depth).sum())
+      if variant == "1":
+        # the starting triple plus depth more edges of the same subject
+        batches.append(self.batch.stars(n, depth + 1, rng))
+      else:
+        batches.append(self.path_index(max_triples).chains(n, depth, rng))
+    return batches
+
+  @timed("sample")
+  def __sample_batch(self, amount, category, count, rounds = 4):
+    # rows of generate_batch written as (mapping, query) skeletons like __sample_skeleton's; duplicates and
+    # literals without a range are redrawn, at most rounds times, the per-entry walk fills whatever is left
+    if count and category.startswith("complex"):
+      raise ValueError("Count for complex queries is not supported")
+    kind, variant = category.split("_")
+    deadline = Deadline(self.timeout)
+    term = self.index.term
+    skeletons = []
+    for _ in range(rounds):
+      if len(skeletons) >= amount:
+        break
+      try:
+        batches = self.generate_batch(amount - len(skeletons), category)
+      except LookupError as e:
+        # some drawn shape has no start in this graph, e.g. no typed entity with enough edges; the per-entry walk
+        # redraws the shape every attempt and its failures reach the scheduler, which stops the category if need be
+        self.metrics.count(f"{category}.batch_errors")
+        self.scheduler.reject(category, type(e).__name__)
+        break
+      for (subjects, preds, objs) in batches:
+        for row in zip(subjects.tolist(), preds.tolist(), objs.tolist()):
+          triples = [(term(s), term(p), term(o)) for (s, p, o) in zip(*row)]
+          try:
+            if kind == "simple":
+              mapping, query = self.__local_simple(variant, triples[0], count, deadline, self.__local_label)
+              query = to_count_query(query) if count else query
+            else:
+              query = f"select ?x {{ {' . '.join(self.__local_patterns(variant, triples))} . }}"
+              self.__claim(query)
+              mapping = self.__complex_mapping(variant, triples, self.__local_label)
+          except DuplicateQueryError:
+            self.metrics.count(f"{category}.duplicates")
+            self.scheduler.reject(category, "duplicate")
+            continue
+          except IndexError:
+            self.metrics.count(f"{category}.errors")
+            self.scheduler.reject(category, "IndexError")
+            continue
+          self.scheduler.accept(category)
+          skeletons.append((mapping, query))
+    self.metrics.count(f"{category}.batched", len(skeletons))
+    return skeletons
+
+  def answer_index(self):
+    if self.answers is None:
+      from answers import LocalAnswers, RemoteAnswers
+      if self.is_api:
+        self.answers = RemoteAnswers(self.__select, limit=self.answer_limit, select_many=self.__select_many)
+      elif self.store:
+        from store import StoreAnswers
+        self.answers = StoreAnswers(self.index, self.answer_limit)
+      else:
+        self.answers = LocalAnswers(self.index, self.answer_limit)
+    return self.answers
+
+  @timed("validate")
+  def __validate(self, skeletons, category, count):
+    # runs the whole chunk at once, remote queries go out as a few batched requests
+    if not self.validate:
+      return [(mapping, query, None) for (mapping, query) in skeletons]
+    answers = self.answer_index()
+    try:
+      results = answers.answer_many([query for (_, query) in skeletons], count, self.timeout)
+    except Exception as e:
+      # a timeout or a dropped connection fails the whole batch, one query at a time only loses the ones that fail
+      print(f"Validation failed ({e}), checking queries one by one")
+      results = []
+      for (_, query) in skeletons:
+        try:
+          results.append(answers.answer_many([query], count, self.timeout)[0])
+        except Exception as e:
+          results.append(e)
+    validated = []
+    for (mapping, query), answer in zip(skeletons, results):
+      if isinstance(answer, Exception):
+        self.metrics.count(f"{category}.validation_errors")
+        self.scheduler.reject(category, type(answer).__name__)
+        print(f"Validation error: {answer}, repeating")
+        continue
+      if not answer:
+        self.metrics.count(f"{category}.empty")
+        self.scheduler.reject(category, "empty")
+        print("Empty answer, repeating")
+        continue
+      validated.append((mapping, query, answer))
+    return validated
+
+  def path_index(self, max_depth: int = 3):
+    if self.paths is None or self.paths.max_depth < max_depth:
+      if self.store:
+        from store import StorePaths
+        self.paths = StorePaths(self.index, max_depth)
+      else:
+        from paths import PathIndex
+        self.paths = PathIndex(self.index, max_depth)
+      feasible = ", ".join(f"depth {d}: {r['starts']} starts, {r['chains']} chains" for d, r in self.paths.distribution().items())
+      print(f"Built path index ({feasible})")
+    return self.paths
+
+  def __select(self, query, timeout = None):
+    return self.client.select(query, timeout)
+
+  def __select_many(self, queries, timeout = None):
+    return self.client.select_many(queries, timeout)
+
+  def __stage_deadline(self, deadline, stage):
+    # started when the stage starts, so a slow sampling stage does not eat into the label budget
+    return deadline.stage(self.stage_budgets.get(stage))
+
+  def __describe_mapping(self, mapping, query):
     mapping_in_sentence = ""
     for uri, label in mapping.items():
       if "dbpedia" in self.source:
@@ -99,71 +596,72 @@ class QADatasetGenerator:
       else:
         if uri in query:
           mapping_in_sentence += f"{uri} has human-readable name '{label}'\n"
+    return mapping_in_sentence
 
-    prompt = f"""Having a SPARQL query:
-{query}
-Where:
-{mapping_in_sentence}
-Transform the SPARQL query to a natural language question.
-Output just the transformed question
-    """
-    result = chat_model.invoke(prompt).content
-    if "Here" in result:
-      matched = re.search(r'"(.*?)"', result, re.DOTALL)
-      if matched:
-        return matched.group(1)
-      else:
-        return result
-    return result
+  def __claim(self, query):
+    # runs before labels and the llm, so a duplicate only costs its sampling
+    if query in self.seen or not self.claimed.add(query):
+      raise DuplicateQueryError(query)
 
-  def __get_label(self, entity):
+  def new_deduplicator(self):
+    return Deduplicator(self.dedup_bloom)
+
+  def __refine_question(self, mapping, query, deadline):
+    llm_deadline = Deadline(self.stage_budgets.get("llm"), parent=deadline)
+    question = self.verbalizer.verbalize(query, self.__describe_mapping(mapping, query), llm_deadline)
+    if question is None:
+      raise RuntimeError("Verbalization failed")
+    return question
+
+  def __label_iri(self, entity):
+    # wikidata keeps the label on the entity iri, also for wdt: properties
+    if "wikidata" in self.source:
+      return "http://www.wikidata.org/entity/" + entity.split("/")[-1]
+    return entity
+
+  @timed("labels")
+  def __prefetch_labels(self, iris, deadline):
+    # resolve every iri of a candidate query in one round trip, __get_label then hits the cache
+    if not self.is_api:
+      return
+    schema = self.__property_schema()
+    iris = [self.__label_iri(iri) for iri in iris
+            if validators.url(iri) and ("wikidata" not in self.source or "wikidata" in iri)
+            and (schema is None or schema.label(iri, deadline.request_timeout()) is None)]
+    self.labels.get_many(iris, deadline.request_timeout())
+
+  @timed("labels")
+  def __get_label(self, entity, deadline):
     if self.is_api:
-      if "wikidata" in self.source:
-        if "wikidata" in entity:
-          entity = entity.split("/")[-1]
-          entity = f"wd:{entity}"
-          query = f"""
-            select ?lit {{
-              {entity} rdfs:label ?lit .
-              filter (lang(?lit) = 'en')
-            }}
-          """
-          self.wrapper.setQuery(query)
-          self.wrapper.setReturnFormat(JSON)
-          results = self.wrapper.query().convert()['results']['bindings'][0]['lit']['value']
-          return results
-        else:
-          return entity
-      else:
-        # dbpedia
-        query = f"""
-            select ?lit {{
-              <{entity}> rdfs:label ?lit .
-              filter (lang(?lit) = 'en')
-            }}
-          """
-        self.wrapper.setQuery(query)
-        self.wrapper.setReturnFormat(JSON)
-        results = self.wrapper.query().convert()['results']['bindings'][0]['lit']['value']
-        return results
+      if "wikidata" in self.source and "wikidata" not in entity:
+        return entity
+      # properties are labeled from the schema, everything else from the label cache
+      schema = self.__property_schema()
+      label = schema.label(entity, deadline.request_timeout()) if schema is not None else None
+      if label is not None:
+        return label
+      label = self.labels.get(self.__label_iri(entity), deadline.request_timeout())
+      if label is None:
+        self.dead_ends.add("label", entity)
+        raise LookupError(f"No English label for {entity}")
+      return label
     else:
-      try:
-        query = f"""
-          select ?lit {{
-            <{entity}> rdfs:label ?lit .
-          }}
-        """
-        result = list(self.graph.query(query))[0][0].toPython()
-      except:
-        # if literal
-        result = entity.toPython()
-      return result
+      return self.__local_label(entity)
+
+  def __local_label(self, entity):
+    # not timed, generate_batch looks up a few labels per row
+    label = self.index.label(entity)
+    if label is None:
+      # if literal or no label
+      return entity.toPython()
+    return label.toPython()
 
   def __filter_prop_query(self):
     _filter = [f"contains(str(?p), '{uri}') = false" for uri in self.excluded_props]
     return " && ".join(_filter)
 
-  def __random_walk(self, entity):
+  @timed("neighborhood")
+  def __fetch_neighborhood(self, entity, timeout = None):
     filter_prop = self.__filter_prop_query()
     query = f"""
           select ?p ?o {{
@@ -173,65 +671,83 @@ Output just the transformed question
             )
           }}
           """
+    # wikidata, dbpedia is way too huge we can't query like this below
+    results = self.__select(query, timeout)
+    return [(tup['p']['value'], tup['o']['value']) for tup in results]
+
+  @timed("prefetch")
+  def __fetch_neighborhoods(self, entities, limit, timeout = None):
+    # the neighborhoods of many entities in one request, same filter as __fetch_neighborhood
+    filter_prop = self.__filter_prop_query()
+    values = " ".join(f"<{entity}>" for entity in entities)
+    query = f"""
+          select ?s ?p ?o {{
+            values ?s {{ {values} }}
+            ?s ?p ?o .
+            filter (
+              {filter_prop}
+            )
+          }} limit {limit}
+          """
+    results = self.__select(query, timeout)
+    return [(tup['s']['value'], tup['p']['value'], tup['o']['value']) for tup in results]
+
+  def __edges(self, entity, deadline, follow = False):
     if self.is_api:
-      # wikidata, dbpedia is way too huge we can't query like this below
-      self.wrapper.setQuery(query)
-      self.wrapper.setReturnFormat(JSON)
-      results = self.wrapper.query().convert()['results']['bindings']
-      tuples = []
-      for tup in results:
-        tmp_p = tup['p']['value']
-        tmp_o = tup['o']['value']
-        tuples.append((entity, tmp_p, tmp_o))
-      return random.choice(tuples)
-    else:
-      res = list(self.graph.query(query))
-      choice = list(random.choice(res))
-      choice.insert(0, entity)
-      return tuple(choice)
+      # fetched once, already filtered with the provider rules; follow prefetches where a chain can go next
+      return self.neighborhoods.edges(entity, deadline.request_timeout(), follow)
+    # excluded properties are already filtered out by the index
+    return self.index.neighbors(entity)
 
-  def __get_one_triple(self, subject = None):
+  def __random_walk(self, entity, deadline, follow = False, keep = None):
+    edges = self.__edges(entity, deadline, follow)
+    if not edges:
+      # no edge at all, a dead end whatever keep would allow
+      self.dead_ends.add("entity", entity)
+    if keep is not None:
+      edges = [(p, o) for (p, o) in edges if keep(p, o)]
+    p, o = random.choice(edges)
+    return (entity, p, o)
+
+  @timed("walk")
+  def __get_one_triple(self, subject = None, deadline: Deadline = None, follow: bool = False, keep = None,
+                       dead_end: str = "entity", avoid = ("entity",)):
+    # keep filters the edges the walk may take, an entity left without any is remembered as a dead_end of that kind;
+    # a picked entity known as a dead end of a kind in avoid is not walked. Other errors, e.g. of the endpoint,
+    # fail the attempt instead of being retried here until the deadline
     start_given = subject != None
-    err = True
-    while err:
+    deadline = deadline if deadline is not None else Deadline(self.timeout)
+    while True:
+      deadline.check()
+      if not start_given:
+        try:
+          subject = self.__random_pick_entity(deadline)
+        except LookupError:
+          # a class without instances, dropped by the pick
+          continue
+        if any((kind, subject) in self.dead_ends for kind in avoid):
+          self.metrics.count("walk.known_dead_ends")
+          continue
       try:
-        if not start_given:
-          subject = self.__random_pick_entity()
-        triple = self.__random_walk(subject)
-        if self.is_api:
-          if "wikidata" in self.source:
-            while "P31" in triple[1] or not triple[1].startswith("http://www.wikidata.org/prop/direct") \
-              or triple[2].startswith("http://www.wikidata.org/entity/statement/") or (validators.url(triple[2]) and not is_wikidata_entity_iri(triple[2])):
-                triple = self.__random_walk(subject)
-            err = False
-          else:
-            # for dbpedia
-            while not triple[1].startswith("http://dbpedia.org/ontology/") or "wiki" in triple[1]:
-              triple = self.__random_walk(subject)
-            err = False
-        else:
-          err = False
-      except Exception as e:
-        pass
-    return triple
-
-  def __concat_str_with_datatype(self, prop, o):
-    query = f"select ?range {{ <{prop}> rdfs:range ?range . }}"
-    mapping = {
-        "http://www.w3.org/2001/XMLSchema#": "xsd:",
-        "http://dbpedia.org/datatype/": "dbd:"
-    }
-    if "dbpedia" in self.source:
-      self.wrapper.setQuery(query)
-      self.wrapper.setReturnFormat(JSON)
-      datatype = self.wrapper.query().convert()['results']
-      datatype = datatype['bindings'][0]['range']['value']
-      for k, v in mapping.items():
-        tmp = datatype.replace(k, v)
-        if tmp == "xsd:string":
-          return f"'{o}'"
-        datatype = tmp
-      return f"'{o}'^^{datatype}"
+        return self.__random_walk(subject, deadline, follow, keep)
+      except IndexError:
+        # dead end, a picked entity is simply replaced but a given one cannot be
+        self.metrics.count("walk.dead_ends")
+        if dead_end is not None:
+          self.dead_ends.add(dead_end, subject)
+        if start_given:
+          raise LookupError(f"No usable edge from {subject}")
+
+  @timed("range")
+  def __concat_str_with_datatype(self, prop, o, deadline):
+    if ("range", prop) in self.dead_ends:
+      raise IndexError(f"No rdfs:range for {prop}")
+    if self.is_api and "dbpedia" in self.source:
+      datatype = self.__property_schema().range(prop, deadline.request_timeout())
+      if datatype is None:
+        self.dead_ends.add("range", prop)
+        raise IndexError(f"No rdfs:range for {prop}")
+      return typed_literal(o, datatype)
     elif "wikidata" in self.source:
       # manual match because there is no rdfs:range
       datetime_pattern = r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$"
@@ -240,120 +756,162 @@ Output just the transformed question
       else:
         return f'"{o}"'
     else:
-      datatype = list(self.graph.query(query))[0][0]
-      for k, v in mapping.items():
-        tmp = datatype.replace(k, v)
-        if tmp == "xsd:string":
-          return f"'{o}'"
-        datatype = tmp
-      return f"'{o}'^^{datatype}"
-
-  def __is_no_property(self, entity):
-    if isinstance(entity, Literal):
-      return True
-    try:
-      self.__random_walk(entity)
-      return False
-    except IndexError:
-      return True
+      datatype = self.index.range(prop)
+      if datatype is None:
+        self.dead_ends.add("range", prop)
+        raise IndexError(f"No rdfs:range for {prop}")
+      return typed_literal(o, str(datatype))
 
-  def generate_count(self, category):
+  def generate_count(self, category, return_question = True, deadline: Deadline = None):
     # this uses simple pattern only
-    mapping, answer = self.generate_simple(category, return_question=False)
-    new_answer = answer.replace("?x", "(count(?x) as ?cnt)", 1)
-    question = self.__refine_question(mapping, new_answer)
+    deadline = deadline if deadline is not None else Deadline(self.timeout)
+    mapping, answer = self.generate_simple(category, return_question=False, count=True, deadline=deadline)
+    new_answer = to_count_query(answer)
+    if not return_question:
+      return mapping, new_answer
+    question = self.__refine_question(mapping, new_answer, deadline)
     return question, new_answer
 
-  def generate_simple(self, category, return_question = True):
+  def generate_simple(self, category, return_question = True, count = False, deadline: Deadline = None):
     # one triple pattern
     # supports only a b ?x
-    triple = self.__get_one_triple()
+    deadline = deadline if deadline is not None else Deadline(self.timeout)
+    sampling = self.__stage_deadline(deadline, "sampling")
+    keep, avoid = self.__simple_filter(category)
+    triple = self.__get_one_triple(deadline=sampling, keep=keep, dead_end=None, avoid=avoid)
     if "wikidata" in self.source:
       while not triple[1].split("/")[-1].startswith("P"):
-        triple = self.__get_one_triple()
-    query_uri = "select ?x {{ <{s}> <{p}> ?x . }}"
+        triple = self.__get_one_triple(deadline=sampling, keep=keep, dead_end=None, avoid=avoid)
     query_prefix = "select ?x {{ {s} {p} ?x . }}"
     query_prefix_reverse = "select ?x {{ ?x {p} {o} . }}"
-    query_uri_reverse = "select ?x {{ ?x <{p}> {o} . }}"
 
+    # the query is built first so duplicates are dropped before any label lookup
     if self.is_api:
       if "wikidata" in self.source:
-        if is_wikidata_entity_iri(triple[2]):
-          s, p, o = self.__get_label(triple[0]), self.__get_label(triple[1]), self.__get_label(triple[2])
-          s_pref, p_pref, o_pref = triple[0].split("/")[-1], triple[1].split("/")[-1], triple[2].split("/")[-1]
-          s_pref, p_pref, o_pref = f"wd:{s_pref}", f"wdt:{p_pref}", f"wd:{o_pref}"
-        else:
-          s, p, o = self.__get_label(triple[0]), self.__get_label(triple[1]), triple[2]
-          s_pref, p_pref = triple[0].split("/")[-1], triple[1].split("/")[-1]
-          s_pref, p_pref, o_pref = f"wd:{s_pref}", f"wdt:{p_pref}", self.__concat_str_with_datatype(triple[1], o)
-        mapping = {s_pref: s, p_pref: p, o_pref: o}
-        if category == "1":
-          answer = query_prefix.format(s=s_pref, p=p_pref, o=o_pref)
+        is_entity = is_wikidata_entity_iri(triple[2])
+        s_pref, p_pref = triple[0].split("/")[-1], triple[1].split("/")[-1]
+        s_pref, p_pref = f"wd:{s_pref}", f"wdt:{p_pref}"
+        if is_entity:
+          o_pref = "wd:" + triple[2].split("/")[-1]
         else:
-          answer = query_prefix_reverse.format(s=s_pref, p=p_pref, o=o_pref)
-        if return_question:
-          refined_question = self.__refine_question(mapping, answer)
-          return refined_question, answer
-        else:
-          return mapping, answer
+          o_pref = self.__concat_str_with_datatype(triple[1], triple[2], sampling)
       else:
-        if "dbpedia" in triple[2]:
-          # entity
-          s, p, o = self.__get_label(triple[0]), self.__get_label(triple[1]), self.__get_label(triple[2])
-          s_pref, p_pref, o_pref = replace_prefix_dbpedia(triple[0]), replace_prefix_dbpedia(triple[1]), replace_prefix_dbpedia(triple[2])
-        else:
-          s, p, o = self.__get_label(triple[0]), self.__get_label(triple[1]), triple[2]
-          s_pref, p_pref, o_pref = replace_prefix_dbpedia(triple[0]), replace_prefix_dbpedia(triple[1]), self.__concat_str_with_datatype(triple[1], triple[2])
-        mapping = {s_pref: s, p_pref: p, o_pref: o}
-        if category == "1":
-          answer = query_prefix.format(s=s_pref, p=p_pref, o=o_pref)
-        else:
-          answer = query_prefix_reverse.format(s=s_pref, p=p_pref, o=o_pref)
-        if return_question:
-          refined_question = self.__refine_question(mapping, answer)
-          return refined_question, answer
+        # dbpedia
+        is_entity = "dbpedia" in triple[2]
+        s_pref, p_pref = replace_prefix_dbpedia(triple[0]), replace_prefix_dbpedia(triple[1])
+        if is_entity:
+          o_pref = replace_prefix_dbpedia(triple[2])
         else:
-          return mapping, answer
+          o_pref = self.__concat_str_with_datatype(triple[1], triple[2], sampling)
+      if category == "1":
+        answer = query_prefix.format(s=s_pref, p=p_pref, o=o_pref)
+      else:
+        answer = query_prefix_reverse.format(s=s_pref, p=p_pref, o=o_pref)
+      self.__claim(to_count_query(answer) if count else answer)
+
+      labelling = self.__stage_deadline(deadline, "labels")
+      self.__prefetch_labels(triple, labelling)
+      s, p = self.__get_label(triple[0], labelling), self.__get_label(triple[1], labelling)
+      o = self.__get_label(triple[2], labelling) if is_entity else triple[2]
+      mapping = {s_pref: s, p_pref: p, o_pref: o}
+    else:
+      labelling = self.__stage_deadline(deadline, "labels")
+      mapping, answer = self.__local_simple(category, triple, count, sampling, lambda entity: self.__get_label(entity, labelling))
+
+    if return_question:
+      refined_question = self.__refine_question(mapping, answer, deadline)
+      return refined_question, answer
     else:
-      if not isinstance(triple[2], Literal):
-        s, p, o = self.__get_label(triple[0]), self.__get_label(triple[1]), self.__get_label(triple[2])
+      return mapping, answer
+
+  def __simple_filter(self, category):
+    # edges a simple entry would fail on: a literal of a property known without range (every remote simple entry
+    # types its literal, locally only simple_2 does) and, remotely, an object or subject known without label
+    needs_range = self.is_api or category == "2"
+    literal = (lambda o: not is_wikidata_entity_iri(o) and "dbpedia" not in o) if self.is_api else is_literal
+    def keep(p, o):
+      if needs_range and ("range", p) in self.dead_ends and literal(o):
+        return False
+      return not self.is_api or ("label", o) not in self.dead_ends
+    return keep, ("entity", "label") if self.is_api else ("entity",)
+
+  def __local_simple(self, category, triple, count, sampling, label):
+    # query and labels of a simple entry over a local graph, also used for the rows of generate_batch;
+    # with count the query is claimed as the count query generate_count turns it into
+    query_uri = "select ?x {{ <{s}> <{p}> ?x . }}"
+    query_uri_reverse = "select ?x {{ ?x <{p}> {o} . }}"
+    if category == "1":
+      answer = query_uri.format(s=triple[0], p=triple[1], o=triple[2])
+    else:
+      if not is_literal(triple[2]):
+        answer = query_uri_reverse.format(s=triple[0], p=triple[1], o=f"<{triple[2]}>")
       else:
-        s, p, o = self.__get_label(triple[0]), self.__get_label(triple[1]), triple[2].toPython()
-      mapping = {triple[0]: s, triple[1]: p, triple[2]: o}
-      if category == "1":
-        answer = query_uri.format(s=triple[0], p=triple[1], o=triple[2])
+        answer = query_uri_reverse.format(s=triple[0], p=triple[1], o=f"{self.__concat_str_with_datatype(triple[1], triple[2], sampling)}")
+    self.__claim(to_count_query(answer) if count else answer)
+
+    if not is_literal(triple[2]):
+      s, p, o = label(triple[0]), label(triple[1]), label(triple[2])
+    else:
+      s, p, o = label(triple[0]), label(triple[1]), triple[2].toPython()
+    return {triple[0]: s, triple[1]: p, triple[2]: o}, answer
+
+  def __local_patterns(self, category, triples):
+    # complex_1 puts every triple on ?x, complex_2 chains them through fresh variables
+    if category == '1':
+      return [f"?x <{p}> '{o}'" if is_literal(o) else f"?x <{p}> <{o}>" for (_, p, o) in triples]
+    triple_pattern = []
+    curr_var = "x"
+    for i in range(len(triples)):
+      p = triples[i][1]
+      o = triples[i][2]
+      if i == len(triples) - 1:
+        triple_pattern.append(f"?{curr_var} <{p}> '{o}'" if is_literal(o) else f"?{curr_var} <{p}> <{o}>")
       else:
-        if not isinstance(triple[2], Literal):
-          answer = query_uri_reverse.format(s=triple[0], p=triple[1], o=f"<{triple[2]}>")
-        else:
-          answer = query_uri_reverse.format(s=triple[0], p=triple[1], o=f"{self.__concat_str_with_datatype(triple[1], triple[2])}")
-      if return_question:
-        refined_question = self.__refine_question(mapping, answer)
-        return refined_question, answer
+        triple_pattern.append(f"?{curr_var} <{p}> ?{get_next_variable(curr_var)}")
+      curr_var = get_next_variable(curr_var)
+    return triple_pattern
+
+  def __complex_mapping(self, category, triples, label):
+    # complex_1 keeps literal and foreign objects as they are, complex_2 labels every term of the chain
+    mapping = {}
+    for (_, p, o) in triples:
+      if category == '2' or is_wikidata_entity_iri(o) or is_dbpedia_entity_iri(o):
+        p_label, o_label = label(p), label(o)
       else:
-        return mapping, answer
+        p_label, o_label = label(p), o
+      mapping[p] = p_label
+      mapping[o] = o_label
+    return mapping
 
-  def generate_complex(self, category, max_triples = 3):
-    starting_triple = self.__get_one_triple()
+  def generate_complex(self, category, max_triples = 3, return_question = True, deadline: Deadline = None):
+    deadline = deadline if deadline is not None else Deadline(self.timeout)
+    sampling = self.__stage_deadline(deadline, "sampling")
+    # local chains come straight from the path index
+    if self.is_api or category != '2':
+      starting_triple = self.__get_one_triple(deadline=sampling, follow=category == '2')
     depth = random.choice([i for i in range(2, max_triples)])
 
     if category == '1':
       # pattern: ?x y z ; a b .
       subject = starting_triple[0]
-      triples = set()
-      triples.add(starting_triple)
-      while len(triples) <= depth:
-        triple = self.__get_one_triple(subject)
-        if self.is_api:
-          if is_wikidata_entity_iri(triple[-1]):
-            triples.add(triple)
-          else:
-            # dbpedia
-            pref_repr = replace_prefix_dbpedia(triple[-1])
-            if pref_repr.startswith("dbo:") or pref_repr.startswith("dbr:"):
-              triples.add(triple)
-        else:
-          triples.add(triple)
+      # a list, a set would put the patterns in hash order and seeded runs would word the queries differently
+      triples = [starting_triple]
+      # the subject's neighborhood is already at hand, take the other triples from it in one go
+      candidates = []
+      for (p, o) in self.__edges(subject, sampling):
+        if (subject, p, o) == starting_triple:
+          continue
+        if self.is_api and not is_wikidata_entity_iri(o):
+          # dbpedia
+          pref_repr = replace_prefix_dbpedia(o)
+          if not (pref_repr.startswith("dbo:") or pref_repr.startswith("dbr:")):
+            continue
+        candidates.append((p, o))
+      if len(candidates) < depth:
+        raise LookupError(f"Not enough edges from {subject}")
+      for (p, o) in random.sample(candidates, depth):
+        if (subject, p, o) not in triples:
+          triples.append((subject, p, o))
 
       if self.is_api:
         if "wikidata" in self.source:
@@ -378,21 +936,16 @@ Output just the transformed question
               tmp_p = replace_prefix_dbpedia(p)
               triple_pattern.append(f"?x {tmp_p} '{o}'")
       else:
-        triple_pattern = [
-            f"?x <{p}> '{o}'" if isinstance(o, Literal) else f"?x <{p}> <{o}>"
-            for (_, p, o) in triples
-        ]
+        triple_pattern = self.__local_patterns(category, triples)
       triple_pattern = " . ".join(triple_pattern) + " ."
       query = f"select ?x {{ {triple_pattern} }}"
-      mapping = {}
-      for (_, p, o) in triples:
-        if is_wikidata_entity_iri(o) or is_dbpedia_entity_iri(o):
-          p_label, o_label = self.__get_label(p), self.__get_label(o)
-        else:
-          p_label, o_label = self.__get_label(p), o
-        mapping[p] = p_label
-        mapping[o] = o_label
-      refined_question = self.__refine_question(mapping, query)
+      self.__claim(query)
+      labelling = self.__stage_deadline(deadline, "labels")
+      self.__prefetch_labels([t for (_, p, o) in triples for t in (p, o)], labelling)
+      mapping = self.__complex_mapping(category, triples, lambda entity: self.__get_label(entity, labelling))
+      if not return_question:
+        return mapping, query
+      refined_question = self.__refine_question(mapping, query, deadline)
       return refined_question, query
 
     elif category == '2':
@@ -401,54 +954,29 @@ Output just the transformed question
       # excluding the properties mentioned in exclude list
       # kadang ada yg tidak ketemu match, harus repeat
       if not self.is_api:
-        # search such that the first triple is not literal as the object
-        while self.__is_no_property(starting_triple[2]):
-          starting_triple = self.__get_one_triple()
+        # exactly depth triples through non-literal objects, no rejection
+        triples = self.path_index(max_triples).chain(depth)
       else:
         # assume that the depth is quite good
-        if "wikidata" in self.source:
-          while not is_wikidata_entity_iri(starting_triple[2]):
-            starting_triple = self.__get_one_triple()
-        else:
-          # dbpedia
-          while not is_dbpedia_entity_iri(starting_triple[2]):
-            starting_triple = self.__get_one_triple()
-      triples = []
-      triples.append(starting_triple)
+        is_entity = is_wikidata_entity_iri if "wikidata" in self.source else is_dbpedia_entity_iri
+        # an object the chain goes on from must not be a known dead end
+        walkable = lambda o: is_entity(o) and ("entity", o) not in self.dead_ends and ("hop", o) not in self.dead_ends
+        while not walkable(starting_triple[2]):
+          starting_triple = self.__get_one_triple(deadline=sampling, follow=True)
+        triples = []
+        triples.append(starting_triple)
 
       if self.is_api:
-        if "wikidata" in self.source:
-          # no literal for easiness of searching
-          while len(triples) <= depth:
-            triple = self.__get_one_triple(triples[-1][2])
-            while not is_wikidata_entity_iri(triple[2]):
-              triple = self.__get_one_triple(triples[-1][2])
-            triples.append(triple)
-        else:
-          #dbpedia
-          while len(triples) <= depth:
-            triple = self.__get_one_triple(triples[-1][2])
-            while not is_dbpedia_entity_iri(triple[2]):
-              triple = self.__get_one_triple(triples[-1][2])
-            triples.append(triple)
-      else:
-        triple = starting_triple
-        while len(triples) < depth and not isinstance(triple[2], Literal):
-          triple = self.__get_one_triple(triples[-1][2])
-          triples.append(triple)
+        # no literal for easiness of searching, drawn among the edges to entities of the current hop,
+        # the last object ends the chain and need not go anywhere
+        while len(triples) <= depth:
+          keep = (lambda p, o: walkable(o)) if len(triples) < depth else (lambda p, o: is_entity(o))
+          triples.append(self.__get_one_triple(triples[-1][2], sampling, follow=True, keep=keep, dead_end="hop"))
 
       triple_pattern = []
       curr_var = "x"
       if not self.is_api:
-        for i in range(len(triples)):
-          p = triples[i][1]
-          o = triples[i][2]
-          if i == len(triples) - 1:
-            triple_pattern.append(f"?{curr_var} <{p}> '{o}'" if isinstance(o, Literal) else f"?{curr_var} <{p}> <{o}>")
-          else:
-            triple_pattern.append(f"?{curr_var} <{p}> ?{get_next_variable(curr_var)}")
-          curr_var = get_next_variable(curr_var)
-        triple_pattern = " . ".join(triple_pattern) + " ."
+        triple_pattern = " . ".join(self.__local_patterns(category, triples)) + " ."
       else:
         if "wikidata" in self.source:
           for i in range(len(triples)):
@@ -476,66 +1004,64 @@ Output just the transformed question
             curr_var = get_next_variable(curr_var)
           triple_pattern = " . ".join(triple_pattern) + " ."
       query = f"select ?x {{ {triple_pattern} }}"
-      mapping = {}
-      for i in range(len(triples)):
-        s, p, o = triples[i]
-        p_label, o_label = self.__get_label(p), self.__get_label(o)
-        mapping[p] = p_label
-        mapping[o] = o_label
-      refined_question = self.__refine_question(mapping, query)
+      self.__claim(query)
+      labelling = self.__stage_deadline(deadline, "labels")
+      self.__prefetch_labels([t for (_, p, o) in triples for t in (p, o)], labelling)
+      mapping = self.__complex_mapping(category, triples, lambda entity: self.__get_label(entity, labelling))
+      if not return_question:
+        return mapping, query
+      refined_question = self.__refine_question(mapping, query, deadline)
       return refined_question, query
 
-  def __random_pick_entity(self):
+  def __load_classes(self):
+    # read once, every pick samples from this list
+    with open(self.classes_file, 'r') as f:
+      category = f.read()
+    provider = "dbp" if "dbpedia" in self.source else "wd"
+    cleaned = category.strip().split("\n")
+    options = []
+    for row in cleaned:
+      # columns are tab separated, but some rows were saved with spaces
+      opt = row.split()
+      if provider == "dbp":
+        options.append(opt[1].strip())
+      else:
+        options.append(opt[0].strip())
+    return options
+
+  def __class_sizes(self):
+    # instances of every allowed class in the profile, so pools skip their count query; classes without any are dropped
+    from kgprofile import expand_class
+    sizes = {name: self.stats["classes"].get(expand_class(name), 0) for name in self.classes}
+    self.classes = [name for name in self.classes if sizes[name] > 0]
+    if not self.classes:
+      raise ValueError(f"None of the classes in {self.classes_file} has instances according to {self.stats_path}")
+    return sizes
+
+  @timed("pick_entity")
+  def __random_pick_entity(self, deadline):
     if self.is_api:
       # cannot for loop and pick one here
       # we have to pick some predefined entities
-      with open(self.classes_file, 'r') as f:
-        category = f.read()
-      provider = "dbp" if "dbpedia" in self.source else "wd"
-      cleaned = category.strip().split("\n")
-      options = []
-      for row in cleaned:
-        opt = row.split("\t")
-        if provider == "dbp":
-          options.append(opt[1].strip())
-        else:
-          options.append(opt[0].strip())
-      picked = random.choice(options)
-      if provider == "dbp":
-        query_amount = f"""
-        select (count(?s) as ?cnt) {{
-          ?s a {picked} .
-        }}
-        """
-        query = """
-          select ?s {{
-            ?s a {picked} .
-          }} offset {offset} limit 1
-          """
+      classes = [name for name in self.classes if ("class", name) not in self.dead_ends]
+      if not classes:
+        raise SamplingStalled(f"None of the classes in {self.classes_file} has instances at {self.source}")
+      if self.class_sizes:
+        # weighted by class size, so every entity of the profile is about as likely as any other
+        picked = random.choices(classes, weights=[self.class_sizes[name] for name in classes])[0]
       else:
-        query_amount = f"""
-        select (count(?s) as ?cnt) {{
-          ?s wdt:P31 {picked} .
-        }}
-        """
-        query = """
-          select ?s {{
-            ?s wdt:P31 {picked} .
-          }} offset {offset} limit 1
-        """
-      self.wrapper.setQuery(query_amount)
-      self.wrapper.setReturnFormat(JSON)
-      num = self.wrapper.query().convert()['results']['bindings'][0]['cnt']['value']
-
-      self.wrapper.setQuery(query.format(picked=picked, offset=random.randint(0, int(num) - 1)))
-      self.wrapper.setReturnFormat(JSON)
-      result = self.wrapper.query().convert()['results']['bindings'][0]['s']['value']
-
-      return result
+        picked = random.choice(classes)
+      if picked not in self.pools:
+        pattern = f"?s a {picked}" if "dbpedia" in self.source else f"?s wdt:P31 {picked}"
+        # the neighborhoods of the next few starting entities of the class are downloaded before they are picked
+        self.pools[picked] = EntityPool(self.__select, pattern, on_upcoming=self.neighborhoods.prefetch,
+                                        count=self.class_sizes.get(picked), metrics=self.metrics)
+      try:
+        return self.pools[picked].pick(deadline.request_timeout())
+      except LookupError:
+        if self.pools[picked].count == 0:
+          # no instance, the other classes are picked from now on
+          self.dead_ends.add("class", picked)
+        raise
     else:
-      candidates = set()
-      for (s, p, _) in self.graph:
-        if p == RDF['type']:
-          candidates.add(s)
-      entity = random.choice(list(candidates))
-      return entity
\ No newline at end of file
+      return random.choice(self.index.typed_entities)
\ No newline at end of file
@@ -0,0 +1,77 @@
+import numpy as np
+from rdflib import Literal
+from rdflib.namespace import RDF, RDFS
+from util import is_excluded_prop
+
+class GraphIndex:
+    # precomputed lookups over a local graph so sampling never goes through rdflib's sparql engine
+    def __init__(self, graph, excluded_props):
+        self.excluded_props = excluded_props
+        self.adjacency = {}
+        self.labels = {}
+        self.ranges = {}
+        excluded = {}
+        typed = set()
+        # rdflib yields triples in hash order, which changes between interpreter runs; sorted, the adjacency lists,
+        # labels and ranges come out the same every time
+        for (s, p, o) in sorted(graph, key=lambda triple: tuple(term.n3() for term in triple)):
+            if p == RDF.type:
+                typed.add(s)
+            elif p == RDFS.label:
+                self.labels.setdefault(s, o)
+            elif p == RDFS.range:
+                self.ranges.setdefault(s, o)
+            if p not in excluded:
+                excluded[p] = is_excluded_prop(p, excluded_props)
+            if not excluded[p]:
+                self.adjacency.setdefault(s, []).append((p, o))
+        # sorted so that a seeded run picks the same entities every time
+        self.typed_entities = sorted(typed)
+        self.terms = None
+        self.ids = None
+        self.arrays = None
+
+    def edge_arrays(self):
+        # integer csr view of the adjacency (offsets, preds, objs, is_literal, typed), the layout of SnapshotIndex
+        if self.arrays is None:
+            ids = {}
+            for s, edges in self.adjacency.items():
+                ids.setdefault(s, len(ids))
+                for (p, o) in edges:
+                    ids.setdefault(p, len(ids))
+                    ids.setdefault(o, len(ids))
+            for s in self.typed_entities:
+                ids.setdefault(s, len(ids))
+            self.terms = list(ids)
+            self.ids = ids
+            offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+            preds, objs = [], []
+            for s in self.terms:
+                edges = self.adjacency.get(s, [])
+                preds.extend(ids[p] for (p, _) in edges)
+                objs.extend(ids[o] for (_, o) in edges)
+                offsets[ids[s] + 1] = len(edges)
+            self.arrays = (
+                np.cumsum(offsets),
+                np.array(preds, dtype=np.int64),
+                np.array(objs, dtype=np.int64),
+                np.array([isinstance(term, Literal) for term in self.terms], dtype=np.bool_),
+                np.array([ids[s] for s in self.typed_entities], dtype=np.int64),
+            )
+        return self.arrays
+
+    def term(self, i: int):
+        return self.terms[i]
+
+    def id(self, term):
+        self.edge_arrays()
+        return self.ids.get(term)
+
+    def neighbors(self, entity):
+        return self.adjacency.get(entity, [])
+
+    def label(self, entity):
+        return self.labels.get(entity)
+
+    def range(self, prop):
+        return self.ranges.get(prop)
@@ -0,0 +1,35 @@
+import json
+
+CATEGORIES = ["simple_1", "complex_1", "simple_2", "complex_2"]
+
+def read_spec(path: str):
+    if path.endswith(".yaml") or path.endswith(".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("YAML job specs need PyYAML (pip install pyyaml), JSON specs work without it")
+        with open(path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_jobs(path: str):
+    # a list of targets, or {"targets": [...]}; amount can be a list to get the same target in several sizes
+    spec = read_spec(path)
+    if isinstance(spec, dict):
+        spec = spec.get("targets")
+    if not isinstance(spec, list) or not spec:
+        raise ValueError(f"{path} has no targets, expected a list of {{category, amount, count}}")
+    targets = []
+    for target in spec:
+        category, count = target.get("category"), bool(target.get("count", False))
+        if category not in CATEGORIES:
+            raise ValueError(f"Unknown category {category}, expected one of {', '.join(CATEGORIES)}")
+        if count and category.startswith("complex"):
+            raise ValueError("Count for complex queries is not supported")
+        amounts = target.get("amount")
+        for amount in (amounts if isinstance(amounts, list) else [amounts]):
+            if not isinstance(amount, int) or amount <= 0:
+                raise ValueError(f"Amount of {category} must be a positive integer, got {amount}")
+            targets.append({"category": category, "amount": amount, "count": count})
+    return targets
@@ -0,0 +1,191 @@
+import json
+import os
+from array import array
+from collections import Counter
+from dedup import PREFIXES
+from util import is_excluded_prop
+
+STATS_VERSION = 1
+# hashes buffered before a counter compacts them
+CHUNK_SIZE = 1 << 20
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+RDFS_LABEL = "http://www.w3.org/2000/01/rdf-schema#label"
+# wikidata types its entities with a direct claim instead of rdf:type
+TYPE_PROPS = (RDF_TYPE, "http://www.wikidata.org/prop/direct/P31")
+
+# numpy and rdflib are imported by the functions that stream a source, a generation run only reads the stats
+
+def default_stats_path(source: str):
+    return source + ".stats.json"
+
+def expand_class(name: str):
+    # dbo:Airport or wd:Q1248784 as written in classes_allowed.txt, full iris stay as they are
+    for prefix, namespace in PREFIXES.items():
+        if name.startswith(prefix):
+            return namespace + name[len(prefix):]
+    return name.strip("<>")
+
+class HashCounter:
+    # occurrences per term kept as sorted 64-bit hashes and counts, compacted every chunk, so memory follows the
+    # distinct terms and never the triples; a key can remember the hash of the entity it belongs to
+    def __init__(self):
+        import numpy as np
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.owners = np.zeros(0, dtype=np.int64)
+        self.pending = array("q")
+        self.pending_owners = array("q")
+
+    def add(self, term, owner = None):
+        self.pending.append(hash(term))
+        self.pending_owners.append(hash(owner) if owner is not None else 0)
+        if len(self.pending) >= CHUNK_SIZE:
+            self.compact()
+
+    def compact(self):
+        import numpy as np
+        if not self.pending:
+            return
+        keys = np.concatenate((self.keys, np.frombuffer(self.pending, dtype=np.int64)))
+        counts = np.concatenate((self.counts, np.ones(len(self.pending), dtype=np.int64)))
+        owners = np.concatenate((self.owners, np.frombuffer(self.pending_owners, dtype=np.int64)))
+        self.pending, self.pending_owners = array("q"), array("q")
+        self.keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts, minlength=len(self.keys)).astype(np.int64)
+        self.owners = owners[first]
+
+    def __len__(self):
+        self.compact()
+        return len(self.keys)
+
+    def lookup(self, keys):
+        # counts of the given hashes, 0 for the ones never added
+        import numpy as np
+        self.compact()
+        if len(self.keys) == 0:
+            return np.zeros(len(keys), dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[i] == keys, self.counts[i], 0)
+
+def degree_histogram(degrees):
+    # power-of-two buckets: "1", "2-3", "4-7", ...
+    import numpy as np
+    degrees = degrees[degrees > 0]
+    buckets = Counter(np.floor(np.log2(degrees)).astype(np.int64).tolist())
+    return {(f"{2 ** b}-{2 ** (b + 1) - 1}" if b else "1"): buckets[b] for b in sorted(buckets)}
+
+def choose(n, k: int):
+    # binomial coefficients of an array, as floats since they outgrow int64 on hub entities
+    import numpy as np
+    result = np.ones(len(n), dtype=np.float64)
+    for j in range(k):
+        result *= np.maximum(n - j, 0) / (j + 1)
+    return result
+
+def profile_source(source: str, excluded_props, classes_file: str = None, path: str = None, max_triples: int = 3):
+    # one streaming pass over the source: exact counters for predicates and classes, hashed counters per entity
+    import numpy as np
+    from rdflib import BNode, Literal
+    from snapshot import file_sha256, source_meta
+    from store import stream_triples
+    path = path or default_stats_path(source)
+
+    predicates = Counter()
+    literal_objects = Counter()
+    classes = Counter()
+    objects = Counter()
+    excluded = {}
+    degree, typed, labeled, in_degree = HashCounter(), HashCounter(), HashCounter(), HashCounter()
+    # distinct (s, p) and (p, o) pairs of the kept edges, what simple queries are made of
+    subject_props, prop_objects = HashCounter(), HashCounter()
+    iri_props = set()
+    triples = 0
+
+    def add(s, p, o):
+        nonlocal triples
+        triples += 1
+        p = str(p)
+        predicates[p] += 1
+        if p not in excluded:
+            excluded[p] = is_excluded_prop(p, excluded_props)
+        if isinstance(o, Literal):
+            literal_objects[p] += 1
+            objects["literal"] += 1
+        else:
+            objects["blank" if isinstance(o, BNode) else "iri"] += 1
+        if p in TYPE_PROPS:
+            classes[str(o)] += 1
+            typed.add(s)
+        elif p == RDFS_LABEL:
+            labeled.add(s)
+        if not excluded[p]:
+            degree.add(s)
+            subject_props.add((s, p), owner=s)
+            prop_objects.add((p, o))
+            if not isinstance(o, Literal):
+                in_degree.add(o)
+                iri_props.add(p)
+    stream_triples(source, add)
+
+    # a subject counted twice in typed or labeled is still one entity
+    typed_degrees = degree.lookup(typed.keys) if len(typed) else np.zeros(0, dtype=np.int64)
+    labeled_typed = int((labeled.lookup(typed.keys) > 0).sum()) if len(typed) else 0
+    # chains ?x p1 ?y . ?y p2 o through a non-literal ?y, from any subject: in-degree times out-degree of ?y
+    through = float((in_degree.counts * degree.lookup(in_degree.keys)).sum()) if len(in_degree) else 0.0
+    edges = int(typed_degrees.sum())
+    # distinct queries of every category: exact for simple_1, upper bounds for the others
+    capacity = {
+        "simple_1": int((typed.lookup(subject_props.owners) > 0).sum()) if len(subject_props) else 0,
+        "simple_2": min(edges, len(prop_objects)),
+        # the starting edge plus depth more of the same subject
+        "complex_1": int(sum(choose(typed_degrees, depth + 1).sum() for depth in range(2, max_triples))),
+        # a chain query is its predicates and last object, whatever entities it goes through
+        "complex_2": int(min(through, float(len(iri_props)) * len(prop_objects))),
+    }
+
+    kept = sum(n for p, n in predicates.items() if not excluded[p])
+    stats = source_meta(source, excluded_props)
+    stats.update({
+        "stats_version": STATS_VERSION,
+        "sha256": file_sha256(source),
+        "triples": triples,
+        "kept_triples": kept,
+        "objects": dict(objects),
+        "predicates": {p: {"triples": n, "literal_objects": literal_objects[p], "excluded": excluded[p]} for p, n in predicates.most_common()},
+        # triples dropped by each excluded property
+        "excluded_triples": {uri: sum(n for p, n in predicates.items() if uri in p) for uri in excluded_props},
+        "classes": dict(classes.most_common()),
+        "entities": {
+            "subjects": len(degree),
+            "typed": len(typed),
+            "typed_with_edges": int((typed_degrees > 0).sum()),
+            "typed_labeled": labeled_typed,
+            "label_coverage": round(labeled_typed / len(typed), 4) if len(typed) else 0,
+        },
+        "degrees": {"all": degree_histogram(degree.counts), "typed": degree_histogram(typed_degrees)},
+        "capacity": capacity,
+    })
+    if classes_file and os.path.exists(classes_file):
+        with open(classes_file, "r") as f:
+            names = [name for row in f.read().strip().split("\n") for name in row.split()]
+        stats["allowed_classes"] = {name: classes.get(expand_class(name), 0) for name in names}
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=4)
+    return path, stats
+
+def load_stats(path: str, source: str = None, excluded_props = None):
+    # source is given for a local graph, whose profile must describe the file as it is now;
+    # the profile of a dump stands in for its remote endpoint as it is
+    with open(path, "r", encoding="utf-8") as f:
+        stats = json.load(f)
+    if stats.get("stats_version") != STATS_VERSION:
+        raise ValueError(f"{path} was written by another version of main.py profile, profile the source again")
+    if source is not None:
+        from snapshot import file_sha256, source_meta
+        current = source_meta(source, excluded_props)
+        if stats["source"] != current["source"] or stats["excluded_props"] != current["excluded_props"] \
+                or stats["size"] != current["size"] \
+                or (stats["mtime"] != current["mtime"] and stats["sha256"] != file_sha256(source)):
+            raise ValueError(f"{path} does not describe {source} with the current excluded properties, profile it again")
+    return stats
@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from metrics import Metrics
+
+class LabelCache:
+    # english labels for remote iris: in-process lru -> sqlite shared between runs -> batched VALUES query
+    # a None label means we already asked and the endpoint has no english label for it
+    def __init__(self, select, path: str = None, lru_size: int = 50000, batch_size: int = 200, select_many = None,
+                 metrics: Metrics = None):
+        self.select = select
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.select_many = select_many
+        self.lru = OrderedDict()
+        self.lru_size = lru_size
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            # shared by every worker process: wait for the others' writes instead of failing on a locked database
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.db.execute("pragma journal_mode=wal")
+            self.db.execute("create table if not exists labels (iri text primary key, label text)")
+            self.db.commit()
+
+    def get(self, iri, timeout: float = None):
+        return self.get_many([iri], timeout)[iri]
+
+    def get_many(self, iris, timeout: float = None):
+        result = {}
+        pending = []
+        with self.lock:
+            for iri in dict.fromkeys(iris):
+                if iri in self.lru:
+                    self.lru.move_to_end(iri)
+                    result[iri] = self.lru[iri]
+                else:
+                    pending.append(iri)
+            self.metrics.cache("labels", True, len(result))
+            self.metrics.cache("labels", False, len(pending))
+            if pending and self.db is not None:
+                for found, label in self.__read_db(pending):
+                    result[found] = label
+                    self.__remember(found, label)
+                missing = [iri for iri in pending if iri not in result]
+                self.metrics.cache("labels_db", True, len(pending) - len(missing))
+                self.metrics.cache("labels_db", False, len(missing))
+                pending = missing
+        if not pending:
+            return result
+
+        fetched = {}
+        queries = [self.__query(pending[i:i + self.batch_size]) for i in range(0, len(pending), self.batch_size)]
+        # the batches go out concurrently when the client can do that
+        if self.select_many is not None and len(queries) > 1:
+            results = self.select_many(queries, timeout)
+        else:
+            results = [self.select(query, timeout) for query in queries]
+        for rows in results:
+            for row in rows:
+                fetched.setdefault(row['e']['value'], row['lit']['value'])
+        with self.lock:
+            for iri in pending:
+                # negative entry for everything the endpoint did not return
+                label = fetched.get(iri)
+                result[iri] = label
+                self.__remember(iri, label)
+            if self.db is not None:
+                self.db.executemany("insert or replace into labels values (?, ?)", [(iri, result[iri]) for iri in pending])
+                self.db.commit()
+        return result
+
+    def __read_db(self, iris):
+        rows = []
+        for i in range(0, len(iris), 500):
+            chunk = iris[i:i + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows.extend(self.db.execute(f"select iri, label from labels where iri in ({placeholders})", chunk).fetchall())
+        return rows
+
+    def __query(self, iris):
+        values = " ".join(f"<{iri}>" for iri in iris)
+        return f"""
+            select ?e ?lit {{
+              values ?e {{ {values} }}
+              ?e rdfs:label ?lit .
+              filter (lang(?lit) = 'en')
+            }}
+          """
+
+    def __remember(self, iri, label):
+        self.lru[iri] = label
+        self.lru.move_to_end(iri)
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
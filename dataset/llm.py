@@ -1,14 +1,5 @@
 import os
-from langchain_community.llms import HuggingFaceHub
-from langchain_huggingface import ChatHuggingFace
 import warnings
-from dotenv import load_dotenv
-
-load_dotenv()
-
-warnings.filterwarnings("ignore")
-
-token = os.getenv('HF_TOKEN')
 
 model_kwargs = {
     "device": False,
@@ -16,6 +7,19 @@ model_kwargs = {
     "return_full_text": False,
 }
 
-llm = HuggingFaceHub(repo_id="meta-llama/Meta-Llama-3-8B-Instruct", model_kwargs=model_kwargs, huggingfacehub_api_token=token)
-chat_model = ChatHuggingFace(llm=llm)
+repo_id = "meta-llama/Meta-Llama-3-8B-Instruct"
+
+def new_chat_model():
+    # langchain and the token are only loaded when the first prompt misses the response cache
+    from langchain_community.llms import HuggingFaceHub
+    from langchain_huggingface import ChatHuggingFace
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    warnings.filterwarnings("ignore")
+
+    token = os.getenv('HF_TOKEN')
 
+    llm = HuggingFaceHub(repo_id=repo_id, model_kwargs=model_kwargs, huggingfacehub_api_token=token)
+    return ChatHuggingFace(llm=llm)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from util import reopened
+
+MODES = ("readwrite", "readonly", "off")
+
+def response_key(model_id: str, params: dict, prompt: str):
+    # content address of one llm call, any change of model, generation parameters or prompt misses
+    payload = json.dumps([model_id, params, prompt], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=20).digest()
+
+class ResponseCache:
+    # llm responses on disk, shared between runs and processes, with an in-process lru in front
+    # readonly never writes, so a build can be reproduced from a frozen cache file
+    def __init__(self, path: str, mode: str = "readwrite", max_entries: int = 200000, lru_size: int = 10000):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode}, expected one of {', '.join(MODES)}")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        # db hits are marked as recently used in bulk, on the next write
+        self.touched = {}
+        self.writes = 0
+        self.db = None
+        self.pid = None
+
+    def __connect(self):
+        if not reopened(self):
+            return self.db
+        self.lru = OrderedDict()
+        self.touched = {}
+        if self.mode == "readonly":
+            if not os.path.exists(self.path):
+                self.db = None
+                return None
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            return self.db
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("create table if not exists responses (key blob primary key, content text, used real)")
+        self.db.execute("create index if not exists responses_used on responses (used)")
+        self.db.commit()
+        return self.db
+
+    def get(self, key: bytes):
+        if self.mode == "off":
+            return None
+        with self.lock:
+            db = self.__connect()
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                return self.lru[key]
+            if db is None:
+                return None
+            row = db.execute("select content from responses where key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.__remember(key, row[0])
+            if self.mode == "readwrite":
+                self.touched[key] = time.time()
+            return row[0]
+
+    def put(self, key: bytes, content: str):
+        if self.mode != "readwrite":
+            return
+        with self.lock:
+            db = self.__connect()
+            self.__remember(key, content)
+            now = time.time()
+            rows = [(used, touched) for touched, used in self.touched.items()]
+            self.touched = {}
+            db.executemany("update responses set used = ? where key = ?", rows)
+            db.execute("insert or replace into responses values (?, ?, ?)", (key, content, now))
+            self.writes += 1
+            if self.writes % max(1, min(1000, self.max_entries // 10)) == 0:
+                self.__evict(db)
+            db.commit()
+
+    def __evict(self, db):
+        # least recently used first, down to 90% so eviction does not run on every write
+        size = db.execute("select count(*) from responses").fetchone()[0]
+        if size > self.max_entries:
+            db.execute("delete from responses where key in (select key from responses order by used limit ?)",
+                       (size - int(self.max_entries * 0.9),))
+
+    def __remember(self, key, content):
+        self.lru[key] = content
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def close(self):
+        with self.lock:
+            if self.db is not None and self.pid == os.getpid():
+                if self.mode == "readwrite":
+                    self.__evict(self.db)
+                    self.db.commit()
+                self.db.close()
+            self.db = None
+            self.pid = None
@@ -1,28 +1,181 @@
 import argparse
+import os
+import sys
 
-parser = argparse.ArgumentParser()
+# only argparse is imported up front, rdflib, pandas and the llm client load once the arguments are known
+
+def load_excluded_props():
+    with open("dataset\io\excluded_props.txt", "r") as f:
+        excluded_props = [line.strip() for line in f.readlines()]
+        print("Successfully loaded list of excluded properties")
+    return excluded_props
+
+def add_verbalizer_arguments(parser, backends):
+    parser.add_argument('--verbalizer', type=str, default=backends[0], choices=backends, help='hf: the chat model of dataset/llm.py, openai: a locally hosted OpenAI-compatible server, template: deterministic questions from the query shape and labels, no LLM')
+    parser.add_argument('--openai-base-url', type=str, default="http://localhost:8000/v1", help='Base URL of the OpenAI-compatible server')
+    parser.add_argument('--openai-model', type=str, default=None, help='Model name sent to the OpenAI-compatible server')
+    parser.add_argument('--openai-api-key', type=str, default=os.getenv("OPENAI_API_KEY"), help='API key of the OpenAI-compatible server, defaults to OPENAI_API_KEY')
+    parser.add_argument('--llm-concurrency', type=int, default=4, help='Number of LLM requests in flight')
+    parser.add_argument('--llm-batch-size', type=int, default=1, help='Number of queries verbalized per LLM request')
+    parser.add_argument('--llm-timeout', type=float, default=60, help='Timeout in seconds for one LLM request')
+    parser.add_argument('--llm-retries', type=int, default=2, help='Retries of a failed or timed out LLM request')
+    parser.add_argument('--llm-cache', type=str, default=os.path.join("dataset", "io", "cache", "llm.sqlite"), help='SQLite file caching LLM responses by model, generation parameters and prompt')
+    parser.add_argument('--llm-cache-mode', type=str, default="readwrite", choices=["readwrite", "readonly", "off"], help='readonly never changes the cache, off bypasses it')
+    parser.add_argument('--llm-cache-size', type=int, default=200000, help='Maximum number of cached LLM responses, least recently used ones are evicted')
+
+def new_verbalizer(args):
+    from backends import build_verbalizer
+    backend_options = None
+    if args.verbalizer == "openai":
+        if not args.openai_model:
+            sys.exit("--verbalizer openai needs --openai-model")
+        backend_options = {"base_url": args.openai_base_url, "model": args.openai_model, "api_key": args.openai_api_key}
+    return build_verbalizer(args.verbalizer, backend_options, concurrency=args.llm_concurrency, batch_size=args.llm_batch_size,
+                            timeout=args.llm_timeout, retries=args.llm_retries, cache_path=args.llm_cache,
+                            cache_mode=args.llm_cache_mode, cache_size=args.llm_cache_size)
+
+if len(sys.argv) > 1 and sys.argv[1] == "snapshot":
+    parser = argparse.ArgumentParser(prog="main.py snapshot", description="Parse a local KG once into a memory-mappable snapshot")
+    parser.add_argument('dataset_path', type=str, help='Path to the local dataset')
+    parser.add_argument('--output', type=str, default=None, help='Snapshot directory, defaults to [dataset_path].snapshot')
+    args = parser.parse_args(sys.argv[2:])
+
+    from snapshot import build_snapshot
+    path = build_snapshot(args.dataset_path, load_excluded_props(), args.output)
+    print(f"Finished writing snapshot to {path}")
+    sys.exit(0)
+
+if len(sys.argv) > 1 and sys.argv[1] == "store":
+    parser = argparse.ArgumentParser(prog="main.py store", description="Stream a local KG into an on-disk SQLite store for graphs larger than memory")
+    parser.add_argument('dataset_path', type=str, help='Path to the local dataset, N-Triples is read line by line')
+    parser.add_argument('--output', type=str, default=None, help='Store file, defaults to [dataset_path].store')
+    parser.add_argument('--store-memory', type=int, default=512, help='Megabytes of page cache SQLite may use while building')
+    args = parser.parse_args(sys.argv[2:])
+
+    from store import build_store
+    path = build_store(args.dataset_path, load_excluded_props(), args.output, args.store_memory)
+    print(f"Finished writing store to {path}")
+    sys.exit(0)
+
+if len(sys.argv) > 1 and sys.argv[1] == "profile":
+    parser = argparse.ArgumentParser(prog="main.py profile", description="Stream a KG once and write the statistics generation runs use for capacity checks and sampling")
+    parser.add_argument('dataset_path', type=str, help='Path to the local dataset, or to a dump of a remote KG')
+    parser.add_argument('--output', type=str, default=None, help='Stats file, defaults to [dataset_path].stats.json')
+    parser.add_argument('--classes-file', type=str, default=os.path.join("dataset", "io", "classes_allowed.txt"), help='Allowed classes whose instances are counted')
+    parser.add_argument('--top', type=int, default=10, help='Number of predicates and classes printed')
+    args = parser.parse_args(sys.argv[2:])
+
+    from kgprofile import profile_source
+    path, stats = profile_source(args.dataset_path, load_excluded_props(), args.classes_file, args.output)
+    entities = stats["entities"]
+    print(f"{stats['triples']} triples, {stats['kept_triples']} after excluded properties, {entities['typed']} typed entities, "
+          f"{entities['label_coverage']:.0%} of them labeled")
+    print("Top predicates: " + ", ".join(f"{p} ({n['triples']})" for p, n in list(stats["predicates"].items())[:args.top]))
+    print("Top classes: " + ", ".join(f"{c} ({n})" for c, n in list(stats["classes"].items())[:args.top]))
+    print("Distinct queries at most: " + ", ".join(f"{category} {n}" for category, n in stats["capacity"].items()))
+    print(f"Finished writing stats to {path}")
+    sys.exit(0)
+
+if len(sys.argv) > 1 and sys.argv[1] == "paraphrase":
+    parser = argparse.ArgumentParser(prog="main.py paraphrase", description="Rewrite the questions of a generated dataset, or of a seeded subset of it, with an LLM")
+    parser.add_argument('dataset_file', type=str, help='Generated .json or .jsonl file')
+    parser.add_argument('--fraction', type=float, default=None, help='Fraction of the entries to paraphrase, all of them by default')
+    parser.add_argument('--amount', type=int, default=None, help='Number of entries to paraphrase, instead of --fraction')
+    parser.add_argument('--seed', type=int, default=0, help='Seed choosing the paraphrased entries')
+    parser.add_argument('--output', type=str, default=None, help='Output file, defaults to [dataset_file]_paraphrased with the same extension')
+    add_verbalizer_arguments(parser, ["hf", "openai"])
+    args = parser.parse_args(sys.argv[2:])
+
+    from paraphrase import paraphrase_file
+    verbalizer = new_verbalizer(args)
+    try:
+        output = paraphrase_file(args.dataset_file, verbalizer, args.fraction, args.amount, args.seed, args.output)
+    finally:
+        verbalizer.close()
+    print(f"Finished writing {output}")
+    sys.exit(0)
+
+# main.py jobs takes a spec of several targets instead of one amount and category
+job_mode = len(sys.argv) > 1 and sys.argv[1] == "jobs"
+if job_mode:
+    parser = argparse.ArgumentParser(prog="main.py jobs", description="Generate every target of a job spec in one process, sharing the loaded graph and caches")
+else:
+    parser = argparse.ArgumentParser()
 
 parser.add_argument('dataset_name', type=str, help='Name of the dataset')
 parser.add_argument('dataset_path', type=str, help='Path to dataset or dataset endpoint')
-parser.add_argument('timeout', type=int, help='Timeout in seconds')
-parser.add_argument('amount', type=int, help='Amount of data to be generated')
-parser.add_argument('category', type=str, choices=['simple_1', 'complex_1', 'simple_2', 'complex_2'], help='Category of data to be generated')
-parser.add_argument('--count', action='store_true', help='Whether to generate count query')
+parser.add_argument('timeout', type=float, help='Time budget in seconds for sampling and labelling one entry')
+if job_mode:
+    parser.add_argument('spec', type=str, help='YAML or JSON list of targets, each with a category, an amount (or a list of amounts) and optionally count')
+else:
+    parser.add_argument('amount', type=int, help='Amount of data to be generated')
+    parser.add_argument('category', type=str, choices=['simple_1', 'complex_1', 'simple_2', 'complex_2'], help='Category of data to be generated')
+    parser.add_argument('--count', action='store_true', help='Whether to generate count query')
+parser.add_argument('--label-cache', type=str, default=os.path.join("dataset", "io", "cache", "labels.sqlite"), help='SQLite file caching labels of remote entities between runs')
+parser.add_argument('--schema-cache', type=str, default=os.path.join("dataset", "io", "cache", "schema.sqlite"), help='SQLite file keeping the ranges and labels of remote properties between runs')
+add_verbalizer_arguments(parser, ["hf", "openai", "template"])
+parser.add_argument('--sampling-budget', type=float, default=None, help='Seconds of the entry budget the walk over the graph may use')
+parser.add_argument('--label-budget', type=float, default=None, help='Seconds of the entry budget the label lookups may use')
+parser.add_argument('--llm-budget', type=float, default=None, help='Seconds one entry may spend in verbalization, retries included')
+parser.add_argument('--max-attempts', type=int, default=1000, help='Failed sampling attempts in a row after which a category stops with a partial result, 0 never stops')
+parser.add_argument('--min-acceptance', type=float, default=0.001, help='Acceptance rate over the last --acceptance-window attempts below which a category stops, 0 never stops')
+parser.add_argument('--acceptance-window', type=int, default=10000, help='Number of recent sampling attempts the acceptance rate is computed over')
+parser.add_argument('--workers', type=int, default=1, help='Number of worker processes sharing the generation')
+parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible sampling, every shard derives its own RNG from it')
+parser.add_argument('--bloom-capacity', type=int, default=None, help='Deduplicate with a Bloom filter sized for this many queries instead of an exact hash set')
+parser.add_argument('--sparql-connections', type=int, default=8, help='Size of the HTTP connection pool and of the concurrent SPARQL requests')
+parser.add_argument('--sparql-rate', type=float, default=None, help='Maximum SPARQL requests per second to the endpoint, split between the workers, unlimited by default')
+parser.add_argument('--prefetch-batch', type=int, default=50, help='Remote neighborhoods fetched per background SPARQL request ahead of the walk, 0 fetches them only when needed')
+parser.add_argument('--snapshot', action='store_true', help='Load a local dataset from its binary snapshot, building it first if missing or stale')
+parser.add_argument('--store', action='store_true', help='Keep a local dataset on disk in an SQLite store instead of memory, building it first if missing or stale')
+parser.add_argument('--store-memory', type=int, default=512, help='Megabytes of page and term cache a --store run may use, independent of the graph size')
+parser.add_argument('--stats', type=str, default=None, help='Stats file of main.py profile: stops requests larger than the graph can fill and weights remote classes by size')
+parser.add_argument('--validate', action='store_true', help='Run every candidate query before verbalizing it, drop the ones without answers and store the answers')
+parser.add_argument('--answer-limit', type=int, default=1000, help='Maximum number of answers stored per entry with --validate')
+parser.add_argument('--metrics', type=str, default=None, help='Write per-stage counters, latency histograms and cache hit rates to this JSON file')
+parser.add_argument('--metrics-every', type=float, default=30, help='Seconds between metrics summary lines, 0 disables them')
+parser.add_argument('--profile', type=str, default=None, help='Dump a cProfile of the generation loop of the main process to this file')
+parser.add_argument('--stream', action='store_true', help='Append every entry to a JSONL file as soon as it is generated')
+parser.add_argument('--resume', action='store_true', help='Continue a partial JSONL output instead of starting over (implies --stream)')
 
-args = parser.parse_args()
+args = parser.parse_args(sys.argv[2:] if job_mode else sys.argv[1:])
+if job_mode:
+    # a broken spec fails before the graph is loaded
+    from jobs import load_jobs
+    targets = load_jobs(args.spec)
+excluded_props = load_excluded_props()
 
 name = args.dataset_name
 path = args.dataset_path
-amount = args.amount
-category = args.category
-count = args.count
 timeout = args.timeout
-
-with open("dataset\io\excluded_props.txt", "r") as f:
-    excluded_props = [line.strip() for line in f.readlines()]
-    print("Successfully loaded list of excluded properties")
+label_cache = args.label_cache
+stage_budgets = {"sampling": args.sampling_budget, "labels": args.label_budget, "llm": args.llm_budget}
 
 from generator import QADatasetGenerator
+from failures import CapacityExceeded
+from metrics import profiled
 
-qads = QADatasetGenerator(path, excluded_props, timeout)
-qads.write_to_file(name, amount, category, count)
\ No newline at end of file
+verbalizer = new_verbalizer(args)
+qads = QADatasetGenerator(path, excluded_props, timeout, label_cache=label_cache, schema_cache=args.schema_cache, verbalizer=verbalizer,
+                          dedup_bloom=args.bloom_capacity, snapshot=args.snapshot, store=args.store, store_memory=args.store_memory,
+                          sparql_connections=args.sparql_connections, sparql_rate=args.sparql_rate, prefetch_batch=args.prefetch_batch,
+                          stats=args.stats, max_attempts=args.max_attempts, min_acceptance=args.min_acceptance,
+                          acceptance_window=args.acceptance_window,
+                          stage_budgets={stage: budget for stage, budget in stage_budgets.items() if budget is not None},
+                          metrics_every=args.metrics_every or None, validate=args.validate, answer_limit=args.answer_limit)
+try:
+    with profiled(args.profile):
+        if job_mode:
+            qads.write_jobs(name, targets, workers=args.workers, seed=args.seed, stream=args.stream, resume=args.resume)
+        else:
+            qads.write_to_file(name, args.amount, args.category, args.count, workers=args.workers, seed=args.seed,
+                              stream=args.stream, resume=args.resume)
+except CapacityExceeded as e:
+    sys.exit(str(e))
+finally:
+    verbalizer.close()
+    if args.metrics:
+        qads.metrics.write(args.metrics)
+if qads.shortfalls:
+    # a short file looks like a complete one, the exit status tells scripts it is not
+    sys.exit("\n".join(f"Incomplete: {path} has {written} of {amount} entries ({why})" for path, written, amount, why in qads.shortfalls))
\ No newline at end of file
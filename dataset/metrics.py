@@ -0,0 +1,178 @@
+import cProfile
+import functools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from tqdm import tqdm
+
+def _bucket(seconds):
+    # power-of-two buckets in milliseconds, bucket b holds latencies up to 2**b ms
+    return max(0, math.ceil(math.log2(max(seconds * 1000, 1))))
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        b = _bucket(seconds)
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for b, n in other.buckets.items():
+            self.buckets[b] = self.buckets.get(b, 0) + n
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        rank = q * self.count
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= rank:
+                return min(2 ** b / 1000, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_s": round(self.total, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p90_ms": round(self.quantile(0.9) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "buckets_ms": {str(2 ** b): self.buckets[b] for b in sorted(self.buckets)},
+        }
+
+class Metrics:
+    # per-stage counters and latency histograms of one generation, shared by every thread of a process
+    def __init__(self, report_every: float = None):
+        self.report_every = report_every
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.reported = self.started
+        self.counters = {}
+        self.timings = {}
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            if stage not in self.timings:
+                self.timings[stage] = Histogram()
+            self.timings[stage].add(seconds)
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def cache(self, name: str, hit: bool, n: int = 1):
+        if n:
+            self.count(f"{name}.hits" if hit else f"{name}.misses", n)
+
+    def collect(self):
+        # hands over everything recorded since the last call, worker processes send this with their shards
+        with self.lock:
+            counters, timings = self.counters, self.timings
+            self.counters, self.timings = {}, {}
+        return counters, timings
+
+    def merge(self, collected):
+        counters, timings = collected
+        with self.lock:
+            for name, n in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for stage, histogram in timings.items():
+                if stage not in self.timings:
+                    self.timings[stage] = Histogram()
+                self.timings[stage].merge(histogram)
+
+    def __total(self, suffix):
+        return sum(n for name, n in self.counters.items() if name.endswith(suffix))
+
+    def to_dict(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            accepted = self.__total(".accepted")
+            caches = {name[:-len(".hits")] for name in self.counters if name.endswith(".hits")}
+            caches |= {name[:-len(".misses")] for name in self.counters if name.endswith(".misses")}
+            hit_rates = {}
+            for name in sorted(caches):
+                hits, misses = self.counters.get(f"{name}.hits", 0), self.counters.get(f"{name}.misses", 0)
+                hit_rates[name] = round(hits / (hits + misses), 4)
+            return {
+                "elapsed_s": round(elapsed, 3),
+                "accepted": accepted,
+                "accepted_per_s": round(accepted / elapsed, 4) if elapsed > 0 else 0,
+                "hit_rates": hit_rates,
+                "counters": dict(sorted(self.counters.items())),
+                "timings": {stage: self.timings[stage].to_dict() for stage in sorted(self.timings)},
+            }
+
+    def summary(self):
+        data = self.to_dict()
+        parts = [f"{data['elapsed_s']:.0f}s", f"{data['accepted']} accepted ({data['accepted_per_s']:.2f}/s)"]
+        for stage in ("sample", "walk", "labels", "range", "validate", "sparql", "llm"):
+            if stage in data["timings"]:
+                parts.append(f"{stage} p50 {data['timings'][stage]['p50_ms']:.0f}ms")
+        for name, rate in data["hit_rates"].items():
+            parts.append(f"{name} hit {rate:.0%}")
+        with self.lock:
+            for reason in ("timeouts", "duplicates", "errors", "empty", "llm_failures"):
+                n = self.__total(f".{reason}")
+                if n:
+                    parts.append(f"{reason} {n}")
+        return " | ".join(parts)
+
+    def report(self, force: bool = False):
+        # one summary line every report_every seconds, written above the progress bar
+        now = time.monotonic()
+        if not self.report_every and not force:
+            return
+        if force or now - self.reported >= self.report_every:
+            self.reported = now
+            tqdm.write(f"[metrics] {self.summary()}")
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+def timed(stage: str):
+    # records the duration of a generator method into its metrics
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.time(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+@contextmanager
+def profiled(path: str = None):
+    # cProfile of the enclosed block dumped to path, nothing happens without a path
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,189 @@
+import os
+import random
+import threading
+from collections import OrderedDict, deque
+from metrics import Metrics
+
+class NeighborhoodCache:
+    # accepted (p, o) edges of remote entities, each neighborhood is downloaded once per run
+    # with fetch_many, background threads download queued entities many per request so the walk finds them ready
+    def __init__(self, fetch, accept, size: int = 10000, dead_size: int = 100000, metrics: Metrics = None,
+                 fetch_many = None, hop = None, batch_size: int = 50, row_limit: int = 10000, fanout: int = 50,
+                 queue_size: int = 5000, threads: int = 2, timeout: float = 60):
+        self.fetch = fetch
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.accept = accept
+        self.size = size
+        self.dead_size = dead_size
+        self.lru = OrderedDict()
+        # entities without a single acceptable edge, never worth asking again
+        self.dead = OrderedDict()
+        self.lock = threading.Lock()
+        # fetch_many(entities, limit, timeout) gives (s, p, o) rows, hop tells which objects a walk can continue from
+        self.fetch_many = fetch_many
+        self.hop = hop
+        self.batch_size = batch_size
+        self.row_limit = row_limit
+        self.fanout = fanout
+        self.queue_size = queue_size
+        self.threads = threads
+        self.timeout = timeout
+        # queued (entity, hops) pairs, hops is how many steps further the prefetch may follow from it
+        self.queue = deque()
+        self.queued = set()
+        self.in_flight = {}
+        self.ready = threading.Condition(self.lock)
+        self.workers = []
+        self.closed = False
+        # the threads belong to this process, a forked child has none of them and must not touch the lock
+        self.pid = os.getpid()
+        # drawn from the global generator, so seeded runs prefetch the same next hops
+        self.rng = random.Random(random.getrandbits(64))
+
+    def __contains__(self, entity):
+        with self.lock:
+            return entity in self.lru or entity in self.dead
+
+    def edges(self, entity, timeout: float = None, follow: bool = False):
+        # follow queues the next hops of entity, for walks that go on from one of its objects
+        with self.lock:
+            pending = self.in_flight.get(entity)
+        if pending is not None:
+            # already on its way in a prefetch request, cheaper to wait for it than to ask again; never longer than
+            # a request may take, after that the walk asks for it itself
+            self.metrics.count("neighborhoods.waits")
+            pending.wait(timeout if timeout is not None else self.timeout)
+        with self.lock:
+            if entity in self.dead:
+                self.metrics.cache("neighborhoods", True)
+                return []
+            if entity in self.lru:
+                self.metrics.cache("neighborhoods", True)
+                self.lru.move_to_end(entity)
+                edges = self.lru[entity]
+                self.__follow(edges, 1 if follow else 0, urgent=True)
+                return edges
+        self.metrics.cache("neighborhoods", False)
+        edges = self.put(entity, self.fetch(entity, timeout))
+        with self.lock:
+            self.__follow(edges, 1 if follow else 0, urgent=True)
+        return edges
+
+    def put(self, entity, raw_edges):
+        edges = list(dict.fromkeys((p, o) for (p, o) in raw_edges if self.accept(p, o)))
+        with self.lock:
+            if not edges:
+                self.dead[entity] = True
+                if len(self.dead) > self.dead_size:
+                    self.dead.popitem(last=False)
+                return edges
+            self.lru[entity] = edges
+            self.lru.move_to_end(entity)
+            if len(self.lru) > self.size:
+                self.lru.popitem(last=False)
+        return edges
+
+    def prefetch(self, entities, hops: int = 0):
+        # queue entities for the background threads, hops > 0 also queues up to fanout next hops of each of them
+        if self.fetch_many is None:
+            return
+        with self.lock:
+            for entity in entities:
+                self.__enqueue(entity, hops, urgent=False)
+            self.__start()
+
+    def __enqueue(self, entity, hops, urgent):
+        # called with the lock held; a full queue drops the guess
+        if self.closed or entity in self.lru or entity in self.dead or entity in self.queued or entity in self.in_flight:
+            return
+        if len(self.queue) >= self.queue_size:
+            self.metrics.count("neighborhoods.prefetch_dropped")
+            return
+        self.queued.add(entity)
+        if urgent:
+            self.queue.appendleft((entity, hops))
+        else:
+            self.queue.append((entity, hops))
+        self.ready.notify()
+
+    def __follow(self, edges, hops, urgent = False):
+        # called with the lock held
+        if self.fetch_many is None or self.hop is None or hops < 1:
+            return
+        nexts = [o for (p, o) in edges if self.hop(o)]
+        if len(nexts) > self.fanout:
+            nexts = self.rng.sample(nexts, self.fanout)
+        for o in nexts:
+            self.__enqueue(o, hops - 1, urgent)
+        self.__start()
+
+    def close(self):
+        # stops the prefetch threads once their current request is done, queued entities are dropped
+        if self.pid != os.getpid():
+            return
+        with self.lock:
+            self.closed = True
+            self.queue.clear()
+            self.queued.clear()
+            self.ready.notify_all()
+
+    def __start(self):
+        # called with the lock held, the threads start with the first queued entity
+        while len(self.workers) < self.threads and not self.closed:
+            worker = threading.Thread(target=self.__work, daemon=True)
+            self.workers.append(worker)
+            worker.start()
+
+    def __work(self):
+        while True:
+            with self.lock:
+                while not self.queue and not self.closed:
+                    self.ready.wait()
+                if self.closed:
+                    return
+                batch = []
+                while self.queue and len(batch) < self.batch_size:
+                    entity, hops = self.queue.popleft()
+                    self.queued.discard(entity)
+                    if entity in self.lru or entity in self.dead or entity in self.in_flight:
+                        continue
+                    self.in_flight[entity] = threading.Event()
+                    batch.append((entity, hops))
+            if batch:
+                self.__fetch_batch(batch)
+
+    def __fetch_batch(self, batch):
+        try:
+            rows = self.fetch_many([entity for (entity, _) in batch], self.row_limit, self.timeout)
+        except Exception:
+            # left to the walk, which asks for them one by one
+            self.metrics.count("neighborhoods.prefetch_errors")
+            self.__release(batch)
+            return
+        if len(rows) >= self.row_limit:
+            # cut off at the limit, some neighborhoods are incomplete: ask again in halves, a single
+            # entity that large is left to the walk, whose own request has no limit
+            self.metrics.count("neighborhoods.prefetch_splits")
+            if len(batch) > 1:
+                self.__fetch_batch(batch[:len(batch) // 2])
+                self.__fetch_batch(batch[len(batch) // 2:])
+            else:
+                self.__release(batch)
+            return
+        grouped = {entity: [] for (entity, _) in batch}
+        for (s, p, o) in rows:
+            if s in grouped:
+                grouped[s].append((p, o))
+        self.metrics.count("neighborhoods.prefetched", len(batch))
+        for (entity, hops) in batch:
+            edges = self.put(entity, grouped[entity])
+            with self.lock:
+                self.__follow(edges, hops)
+        self.__release(batch)
+
+    def __release(self, batch):
+        with self.lock:
+            events = [self.in_flight.pop(entity, None) for (entity, _) in batch]
+        for event in events:
+            if event is not None:
+                event.set()
@@ -0,0 +1,72 @@
+import json
+import os
+import time
+
+class JsonlWriter:
+    # append-only output, one accepted entry per line, fsynced every few entries
+    def __init__(self, path: str, fsync_every: int = 50, fsync_seconds: float = 5):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_seconds = fsync_seconds
+        self.file = open(path, "a", encoding="utf-8")
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def write(self, entry: dict):
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync > self.fsync_seconds:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+def read_jsonl(path: str):
+    # one entry at a time, so resuming a huge file does not hold it in memory; a run killed mid-write leaves a
+    # partial last line, it is cut off once the entries before it are read so appending stays valid
+    if not os.path.exists(path):
+        return
+    valid_size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            valid_size += len(line)
+            yield entry
+    if valid_size != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(valid_size)
+
+def iter_jsonl(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def _dump(value, level: int = 2):
+    # same escaping and nesting as pandas' to_json, lists open one indentation level deeper
+    if isinstance(value, list):
+        inner = ",\n".join(" " * 4 * (level + 1) + _dump(item, level + 1) for item in value)
+        return "[\n" + inner + "\n" + " " * 4 * level + "]"
+    return json.dumps(value).replace("/", "\\/")
+
+def compact_jsonl(source: str, target: str):
+    # streams the jsonl into the orient='records', indent=4 layout of write_to_file
+    with open(target, "w", encoding="utf-8") as out:
+        out.write("[")
+        first = True
+        for entry in iter_jsonl(source):
+            fields = ",\n".join(f'        {_dump(k)}:{_dump(v)}' for k, v in entry.items())
+            out.write(("\n" if first else ",\n") + "    {\n" + fields + "\n    }")
+            first = False
+        out.write("\n]" if not first else "]")
@@ -0,0 +1,130 @@
+import multiprocessing as mp
+import random
+from tqdm import tqdm
+from failures import SamplingStalled
+
+# the generator of the current process, inherited through fork or built by _init_worker
+_generator = None
+# queries of the run before the first shard, every shard samples against these and no others
+_seen = None
+
+def _init_worker(config, seen, workers):
+    global _generator, _seen
+    _seen = seen
+    if _generator is None:
+        # spawn: every worker parses the source once
+        from generator import QADatasetGenerator
+        from backends import build_verbalizer
+        config = dict(config)
+        config["verbalizer"] = build_verbalizer(**config["verbalizer"])
+        _generator = QADatasetGenerator(**config)
+    # the workers share the endpoint's request rate
+    _generator.reset_process_state(workers)
+
+def _run_shard(shard):
+    # validated skeletons only: the parent drops the ones another shard already has before they are verbalized,
+    # and a shard's skeletons depend on its seed alone, not on which shards finished before it
+    amount, category, count, seed = shard
+    random.seed(seed)
+    _generator.seen = _seen
+    skeletons, stalled = [], None
+    try:
+        while len(skeletons) < amount and stalled is None:
+            _generator.scheduler.check(category)
+            chunk, stalled = _generator.sample_chunk(amount - len(skeletons), category, count)
+            skeletons += chunk
+    except SamplingStalled as e:
+        stalled = e
+    # what the shard cost travels back with its skeletons, and why it stopped short if it did
+    return skeletons, _generator.metrics.collect(), str(stalled) if stalled is not None else None
+
+def _shards(amount, category, count, seed, first, shard_size):
+    shards = []
+    while amount > 0:
+        size = min(shard_size, amount)
+        # one independent, reproducible stream per shard no matter which worker runs it
+        shards.append((size, category, count, f"{seed}:{first + len(shards)}"))
+        amount -= size
+    return shards
+
+def iter_parallel(generator, amount: int, category: str, count: bool, workers: int, seed: int = 0, seen = None, shard_size: int = 10):
+    global _generator, _seen
+    _generator = generator
+    seen = seen if seen is not None else generator.new_deduplicator()
+    _seen = seen.copy()
+    initial = len(seen)
+    produced = 0
+    # a shard that stalled ends the run, more shards would stall the same way
+    generator.stalled = None
+    # a resumed run continues with shards it has not used yet
+    next_shard = -(-initial // shard_size)
+    progress = tqdm(total=initial + amount, initial=initial)
+
+    def verbalize(skeletons):
+        nonlocal produced
+        entries, failed = generator.verbalize_chunk(skeletons, category, seen)
+        if failed:
+            # one more chance, like in iter_generate
+            entries += generator.verbalize_chunk(failed, category, seen, failed)[0]
+        for entry in entries:
+            produced += 1
+            progress.update(1)
+            yield entry
+
+    def accept(results):
+        # shards are taken in order, so the same seed keeps the same skeletons whatever the number of workers
+        pending, claimed = [], generator.new_deduplicator()
+        for skeletons, shard_metrics, stalled in results:
+            generator.metrics.merge(shard_metrics)
+            generator.stalled = generator.stalled or stalled
+            for skeleton in skeletons:
+                # duplicates across shards are only seen here, they count against the acceptance rate too
+                query = skeleton[1].strip()
+                if query in seen or not claimed.add(query):
+                    generator.metrics.count(f"{category}.duplicates")
+                    generator.scheduler.reject(category, "duplicate")
+                    continue
+                if workers > 1:
+                    # a shard run in this process already counted it
+                    generator.scheduler.accept(category)
+                pending.append(skeleton)
+            if len(pending) >= generator.verbalizer.chunk_size:
+                yield from verbalize(pending)
+                pending, claimed = [], generator.new_deduplicator()
+        yield from verbalize(pending)
+
+    def running():
+        if generator.stalled is None:
+            try:
+                generator.scheduler.check(category)
+            except SamplingStalled as e:
+                generator.stalled = str(e)
+        return produced < amount and generator.stalled is None
+
+    if workers <= 1:
+        while running():
+            shards = _shards(amount - produced, category, count, seed, next_shard, shard_size)
+            next_shard += len(shards)
+            yield from accept(map(_run_shard, shards))
+    else:
+        # fork shares the already parsed graph with every worker
+        ctx = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+        if ctx.get_start_method() == "spawn":
+            _generator = None
+        with ctx.Pool(workers, initializer=_init_worker, initargs=(generator.config, _seen, workers)) as pool:
+            while running():
+                # duplicates across workers are dropped, so top up with fresh shards
+                shards = _shards(amount - produced, category, count, seed, next_shard, shard_size)
+                next_shard += len(shards)
+                yield from accept(pool.imap(_run_shard, shards))
+        _generator = generator
+    progress.close()
+    if generator.stalled is not None:
+        print(f"Stopping after {produced} of {amount} entries, sampling stalled: {generator.stalled}")
+
+def generate_parallel(generator, amount: int, category: str, count: bool, workers: int, seed: int = 0, shard_size: int = 10):
+    questions, queries = [], []
+    for question, query, _ in iter_parallel(generator, amount, category, count, workers, seed=seed, shard_size=shard_size):
+        questions.append(question)
+        queries.append(query)
+    return questions, queries
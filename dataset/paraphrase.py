@@ -0,0 +1,48 @@
+import json
+import os
+import random
+import pandas as pd
+from tqdm import tqdm
+from output import JsonlWriter, iter_jsonl
+
+def read_entries(path: str):
+    if path.endswith(".jsonl"):
+        return list(iter_jsonl(path))
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def paraphrase_file(path: str, verbalizer, fraction: float = None, amount: int = None, seed: int = 0, output: str = None):
+    # rewrites the templated questions of a seeded subset of a finished dataset with an llm,
+    # the template wording stays next to it in template_question
+    entries = read_entries(path)
+    size = amount if amount is not None else round(len(entries) * (fraction if fraction is not None else 1.0))
+    chosen = sorted(random.Random(seed).sample(range(len(entries)), min(size, len(entries))))
+    for entry in entries:
+        entry.setdefault("template_question", entry["question"])
+    paraphrased = 0
+    # a chunk at a time, so millions of entries do not become millions of pending tasks
+    step = verbalizer.chunk_size * 16
+    for start in tqdm(range(0, len(chosen), step)):
+        chunk = chosen[start:start + step]
+        questions = verbalizer.paraphrase_many([(entries[i]["query"], entries[i]["template_question"]) for i in chunk])
+        for i, question in zip(chunk, questions):
+            if question is not None:
+                entries[i]["question"] = question.strip()
+                paraphrased += 1
+    print(f"Paraphrased {paraphrased} of {len(chosen)} selected questions")
+
+    if output is None:
+        root, extension = os.path.splitext(path)
+        output = f"{root}_paraphrased{extension}"
+    if output.endswith(".jsonl"):
+        if os.path.exists(output):
+            os.remove(output)
+        writer = JsonlWriter(output)
+        try:
+            for entry in entries:
+                writer.write(entry)
+        finally:
+            writer.close()
+    else:
+        pd.DataFrame(entries).to_json(output, orient='records', indent=4)
+    return output
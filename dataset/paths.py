@@ -0,0 +1,91 @@
+import random
+import numpy as np
+
+class PathIndex:
+    # how long a chain ?x p1 ?y . ?y p2 ?z ... can get from every entity of a local index, so complex_2
+    # chains of a given length are drawn directly instead of by trial and error
+    # a chain continues only through non-literal objects, its last object can be anything
+    def __init__(self, index, max_depth: int = 3):
+        self.index = index
+        self.max_depth = max_depth
+        offsets, preds, objs, is_literal, typed = index.edge_arrays()
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.preds = preds
+        self.objs = objs
+        n = len(self.offsets) - 1
+        degree = np.diff(self.offsets)
+        subjects = np.repeat(np.arange(n, dtype=np.int64), degree)
+        objs = np.asarray(objs, dtype=np.int64)
+        continues = ~np.asarray(is_literal, dtype=np.bool_)[objs]
+
+        # depth[e]: longest chain from e, capped at max_depth, 0 when e has no edge at all
+        self.depth = np.where(degree > 0, 1, 0).astype(np.int8)
+        for d in range(2, max_depth + 1):
+            ok = continues & (self.depth[objs] >= d - 1)
+            count = np.concatenate(([0], np.cumsum(ok)))
+            reach = (count[self.offsets[1:]] - count[self.offsets[:-1]]) > 0
+            self.depth[reach] = d
+
+        # edges of every subject ordered by how far their object leads, so the edges usable with r hops
+        # left are a prefix of length valid[r][subject]
+        leads = np.where(continues, self.depth[objs], 0)
+        self.order = np.lexsort((-leads, subjects)) if len(objs) else np.zeros(0, dtype=np.int64)
+        self.valid = {1: degree}
+        for r in range(2, max_depth + 1):
+            ok = continues & (leads >= r - 1)
+            count = np.concatenate(([0], np.cumsum(ok)))
+            self.valid[r] = count[self.offsets[1:]] - count[self.offsets[:-1]]
+
+        # valid starting nodes per depth, among the typed entities like every other pick
+        typed = np.asarray(typed, dtype=np.int64)
+        self.starts = {d: typed[self.depth[typed] >= d] for d in range(1, max_depth + 1)}
+
+    def chain(self, depth: int, rng = random):
+        # exactly depth triples, every hop drawn uniformly among the edges that can still finish the chain
+        if depth < 1 or depth > self.max_depth:
+            raise ValueError(f"Depth {depth} outside 1..{self.max_depth}")
+        starts = self.starts[depth]
+        if len(starts) == 0:
+            raise LookupError(f"No chain of depth {depth} in the graph")
+        subject = int(starts[rng.randrange(len(starts))])
+        triples = []
+        for left in range(depth, 0, -1):
+            k = self.order[self.offsets[subject] + rng.randrange(int(self.valid[left][subject]))]
+            p, o = int(self.preds[k]), int(self.objs[k])
+            triples.append((self.index.term(subject), self.index.term(p), self.index.term(o)))
+            subject = o
+        return triples
+
+    def chains(self, n: int, depth: int, rng):
+        # n chains at once as term id arrays of shape (n, depth), the same draws as chain with a numpy generator
+        if depth < 1 or depth > self.max_depth:
+            raise ValueError(f"Depth {depth} outside 1..{self.max_depth}")
+        starts = self.starts[depth]
+        if len(starts) == 0:
+            raise LookupError(f"No chain of depth {depth} in the graph")
+        subjects = np.empty((n, depth), dtype=np.int64)
+        preds = np.empty((n, depth), dtype=np.int64)
+        objs = np.empty((n, depth), dtype=np.int64)
+        subject = starts[rng.integers(0, len(starts), n)]
+        for hop, left in enumerate(range(depth, 0, -1)):
+            k = self.order[self.offsets[subject] + rng.integers(0, self.valid[left][subject])]
+            subjects[:, hop], preds[:, hop], objs[:, hop] = subject, self.preds[k], self.objs[k]
+            subject = objs[:, hop]
+        return subjects, preds, objs
+
+    def distribution(self):
+        # per depth: typed entities a chain of that length can start from, and how many such chains exist
+        n = len(self.offsets) - 1
+        objs = np.asarray(self.objs, dtype=np.int64)
+        continues = ~np.asarray(self.index.edge_arrays()[3], dtype=np.bool_)[objs]
+        chains = np.diff(self.offsets).astype(np.float64)
+        report = {}
+        for d in range(1, self.max_depth + 1):
+            if d > 1:
+                # chains of length d from s: one hop to a non-literal o, then any chain of length d - 1 from o
+                through = np.where(continues, chains[objs], 0.0)
+                count = np.concatenate(([0.0], np.cumsum(through)))
+                chains = count[self.offsets[1:]] - count[self.offsets[:-1]]
+            typed = self.starts[1]
+            report[d] = {"starts": int(len(self.starts[d])), "chains": int(chains[typed].sum()) if n else 0}
+        return report
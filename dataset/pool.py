@@ -0,0 +1,82 @@
+import random
+import threading
+import time
+from metrics import Metrics
+
+class EntityPool:
+    # local supply of entity iris for one class, pulled in pages and refilled in the background
+    def __init__(self, select, pattern: str, page_size: int = 500, low_watermark: int = 100, count_ttl: int = 3600, on_upcoming = None,
+                 lookahead: int = 10, count: int = None, metrics: Metrics = None):
+        self.select = select
+        self.pattern = pattern
+        self.page_size = page_size
+        self.low_watermark = low_watermark
+        self.count_ttl = count_ttl
+        self.entities = []
+        # a count known in advance, e.g. from a profile, is used as is and never asked for
+        self.count = count
+        self.count_fetched_at = 0
+        self.count_known = count is not None
+        self.lock = threading.Lock()
+        self.refilling = False
+        # drawn from the global generator, so a seeded run fetches the same pages and picks the same entities
+        self.rng = random.Random(random.getrandbits(64))
+        self.metrics = metrics if metrics is not None else Metrics()
+        # told which entities the next lookahead picks return, e.g. to prefetch what they will need; not the whole
+        # page, most of a page is picked long after its neighborhoods would have left the cache
+        self.on_upcoming = on_upcoming
+        self.lookahead = lookahead
+
+    def size(self, timeout: float = None):
+        if self.count is None or (not self.count_known and time.monotonic() - self.count_fetched_at > self.count_ttl):
+            query = f"select (count(?s) as ?cnt) {{ {self.pattern} . }}"
+            self.count = int(self.select(query, timeout)[0]['cnt']['value'])
+            self.count_fetched_at = time.monotonic()
+        return self.count
+
+    def __fetch_page(self, timeout = None):
+        count = self.size(timeout)
+        if count == 0:
+            raise LookupError(f"No entities match {self.pattern}")
+        offset = self.rng.randint(0, max(count - self.page_size, 0))
+        query = f"select ?s {{ {self.pattern} . }} offset {offset} limit {self.page_size}"
+        return [row['s']['value'] for row in self.select(query, timeout)]
+
+    def __refill(self, timeout = None):
+        try:
+            page = self.__fetch_page(timeout)
+            # shuffled once, picks pop from the end so the upcoming ones are known; older entities go first
+            self.rng.shuffle(page)
+            with self.lock:
+                self.entities[:0] = page
+        finally:
+            self.refilling = False
+
+    def __refill_in_background(self):
+        # a failed page is not fatal, the buffer still has entities and the next pick below the watermark tries again
+        try:
+            self.__refill()
+        except Exception as e:
+            self.metrics.count("pools.refill_errors")
+            print(f"Could not refill the entities of {self.pattern}: {e}")
+
+    def pick(self, timeout: float = None):
+        with self.lock:
+            empty = len(self.entities) == 0
+            if empty:
+                self.refilling = True
+        if empty:
+            # nothing buffered yet, we have to wait for this page
+            self.__refill(timeout)
+        with self.lock:
+            if len(self.entities) == 0:
+                raise LookupError(f"No entities fetched for {self.pattern}")
+            # every fetched entity is used once
+            entity = self.entities.pop()
+            upcoming = self.entities[-self.lookahead:] if self.lookahead > 0 else []
+            if len(self.entities) < self.low_watermark and not self.refilling:
+                self.refilling = True
+                threading.Thread(target=self.__refill_in_background, daemon=True).start()
+        if self.on_upcoming is not None and upcoming:
+            self.on_upcoming(upcoming)
+        return entity
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+import time
+from metrics import Metrics
+
+# bump when what is stored per property changes, older rows are then loaded again
+SCHEMA_VERSION = 1
+
+DATATYPE_PREFIXES = {
+    "http://www.w3.org/2001/XMLSchema#": "xsd:",
+    "http://dbpedia.org/datatype/": "dbd:",
+}
+
+def typed_literal(value, datatype: str):
+    # 'value'^^xsd:type as the queries write literals, plain strings stay untyped
+    for namespace, prefix in DATATYPE_PREFIXES.items():
+        datatype = datatype.replace(namespace, prefix)
+    if datatype == "xsd:string":
+        return f"'{value}'"
+    if "://" in datatype:
+        return f"'{value}'^^<{datatype}>"
+    return f"'{value}'^^{datatype}"
+
+class SchemaCache:
+    # rdfs:range and english label of every property of an endpoint that declares a range, a few thousand on dbpedia:
+    # pulled page by page in bulk the first time one is needed and kept in sqlite per endpoint and version, so later
+    # runs and workers read them from disk. A property missing from a complete load has no range
+    def __init__(self, select, source: str, path: str = None, page_size: int = 10000, max_age: float = 7 * 86400,
+                 metrics: Metrics = None):
+        self.select = select
+        self.source = source
+        self.page_size = page_size
+        self.max_age = max_age
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.ranges = {}
+        self.labels = {}
+        self.loaded = False
+        # false when the bulk load failed, properties are then asked for one by one
+        self.complete = False
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            # shared by every worker process, like the label cache
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.db.execute("pragma journal_mode=wal")
+            self.db.execute("create table if not exists schema_meta (source text primary key, version integer, loaded_at real)")
+            self.db.execute("create table if not exists schema (source text, prop text, range text, label text, primary key (source, prop))")
+            self.db.commit()
+
+    def load(self, timeout: float = None):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            if self.__read_db():
+                self.metrics.cache("schema_db", True)
+                self.complete = True
+                return
+            self.metrics.cache("schema_db", False)
+            try:
+                with self.metrics.time("schema_load"):
+                    rows = self.__fetch(timeout)
+            except Exception as e:
+                self.metrics.count("schema.load_errors")
+                print(f"Could not load the property schema of {self.source}, asking per property: {e}")
+                return
+            for prop, datatype, label in rows:
+                self.ranges.setdefault(prop, datatype)
+                if label is not None:
+                    self.labels.setdefault(prop, label)
+            self.complete = True
+            self.__write_db()
+
+    def range(self, prop, timeout: float = None):
+        # the range iri of prop, None when it has none
+        self.load(timeout)
+        if prop in self.ranges or self.complete:
+            self.metrics.cache("schema", True)
+            return self.ranges.get(prop)
+        self.metrics.cache("schema", False)
+        rows = self.select(f"select ?range {{ <{prop}> rdfs:range ?range . }}", timeout)
+        self.ranges[prop] = rows[0]['range']['value'] if rows else None
+        return self.ranges[prop]
+
+    def label(self, prop, timeout: float = None):
+        # None for anything that is not a property with a range and an english label, the label cache asks for those
+        self.load(timeout)
+        return self.labels.get(prop)
+
+    def __fetch(self, timeout):
+        rows = []
+        offset = 0
+        while True:
+            query = f"""
+              select ?p ?range ?label {{
+                ?p rdfs:range ?range .
+                optional {{ ?p rdfs:label ?label . filter (lang(?label) = 'en') }}
+              }} order by ?p offset {offset} limit {self.page_size}
+            """
+            page = self.select(query, timeout)
+            rows.extend((row['p']['value'], row['range']['value'], row['label']['value'] if 'label' in row else None) for row in page)
+            if len(page) < self.page_size:
+                return rows
+            offset += self.page_size
+
+    def __read_db(self):
+        if self.db is None:
+            return False
+        meta = self.db.execute("select version, loaded_at from schema_meta where source = ?", (self.source,)).fetchone()
+        if meta is None or meta[0] != SCHEMA_VERSION or time.time() - meta[1] > self.max_age:
+            return False
+        for prop, datatype, label in self.db.execute("select prop, range, label from schema where source = ?", (self.source,)):
+            self.ranges[prop] = datatype
+            if label is not None:
+                self.labels[prop] = label
+        return True
+
+    def __write_db(self):
+        if self.db is None:
+            return
+        self.db.execute("delete from schema where source = ?", (self.source,))
+        self.db.executemany("insert into schema values (?, ?, ?, ?)",
+                            [(self.source, prop, datatype, self.labels.get(prop)) for prop, datatype in self.ranges.items()])
+        self.db.execute("insert or replace into schema_meta values (?, ?, ?)", (self.source, SCHEMA_VERSION, time.time()))
+        self.db.commit()
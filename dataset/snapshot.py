@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import numpy as np
+from rdflib import Graph
+from rdflib.namespace import RDF, RDFS
+from rdflib.util import from_n3
+from util import is_excluded_prop
+
+# 2: edges sorted by subject, predicate and object, smallest label and range ids
+SNAPSHOT_VERSION = 2
+
+def default_snapshot_path(source: str):
+    return source + ".snapshot"
+
+def file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_meta(source: str, excluded_props):
+    stat = os.stat(source)
+    return {
+        "version": SNAPSHOT_VERSION,
+        "source": os.path.abspath(source),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "excluded_props": list(excluded_props),
+    }
+
+def build_snapshot(source: str, excluded_props, path: str = None):
+    # parse once and store dictionary-encoded terms plus integer arrays of everything the generator needs
+    path = path or default_snapshot_path(source)
+    graph = Graph()
+    graph.parse(source)
+
+    terms = set()
+    for triple in graph:
+        terms.update(triple)
+    # ids follow the n3 order, so id lookups are a binary search and typed entities come out sorted
+    ordered = sorted(terms, key=lambda term: term.n3())
+    encoded = [term.n3().encode("utf-8") for term in ordered]
+    ids = {term: i for i, term in enumerate(ordered)}
+    n_terms = len(encoded)
+
+    excluded = {}
+    edges = []
+    typed = set()
+    labels = np.full(n_terms, -1, dtype=np.int64)
+    ranges = np.full(n_terms, -1, dtype=np.int64)
+    for (s, p, o) in graph:
+        if p == RDF.type:
+            typed.add(ids[s])
+        # the smallest id wins, not whichever rdflib yields first, so rebuilds of the same file agree
+        elif p == RDFS.label and (labels[ids[s]] < 0 or ids[o] < labels[ids[s]]):
+            labels[ids[s]] = ids[o]
+        elif p == RDFS.range and (ranges[ids[s]] < 0 or ids[o] < ranges[ids[s]]):
+            ranges[ids[s]] = ids[o]
+        if p not in excluded:
+            excluded[p] = is_excluded_prop(p, excluded_props)
+        if not excluded[p]:
+            edges.append((ids[s], ids[p], ids[o]))
+
+    edges = np.array(edges, dtype=np.int64).reshape(-1, 3)
+    # sorted by subject, then predicate and object, whatever order the graph was parsed in
+    edges = edges[np.lexsort((edges[:, 2], edges[:, 1], edges[:, 0]))]
+    # csr layout: the edges of subject i are preds/objs[offsets[i]:offsets[i + 1]]
+    offsets = np.zeros(n_terms + 1, dtype=np.int64)
+    np.add.at(offsets, edges[:, 0] + 1, 1)
+    offsets = np.cumsum(offsets)
+
+    term_offsets = np.zeros(n_terms + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(n3) for n3 in encoded])
+    is_literal = np.array([n3.startswith(b'"') for n3 in encoded], dtype=np.bool_)
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    with open(os.path.join(path, "terms.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    arrays = {
+        "term_offsets": term_offsets,
+        "is_literal": is_literal,
+        "offsets": offsets,
+        "preds": edges[:, 1].astype(np.int32),
+        "objs": edges[:, 2].astype(np.int32),
+        "typed": np.array(sorted(typed), dtype=np.int32),
+        "labels": labels,
+        "ranges": ranges,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+    meta = source_meta(source, excluded_props)
+    meta["sha256"] = file_sha256(source)
+    # written last, a snapshot without meta is treated as missing
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return path
+
+def is_fresh(source: str, excluded_props, path: str):
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    current = source_meta(source, excluded_props)
+    if meta["version"] != current["version"] or meta["excluded_props"] != current["excluded_props"]:
+        return False
+    if meta["mtime"] == current["mtime"] and meta["size"] == current["size"]:
+        return True
+    # touched but maybe not changed, the hash decides
+    if meta["size"] != current["size"] or meta["sha256"] != file_sha256(source):
+        return False
+    meta.update(mtime=current["mtime"])
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return True
+
+def load_snapshot(source: str, excluded_props, path: str = None):
+    path = path or default_snapshot_path(source)
+    if not is_fresh(source, excluded_props, path):
+        print("Snapshot missing or stale, rebuilding")
+        build_snapshot(source, excluded_props, path)
+    return SnapshotIndex(path)
+
+class TermArray:
+    # sequence view over term ids, decoded on access so random.choice works without materializing
+    def __init__(self, index, ids):
+        self.index = index
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return self.index.term(int(self.ids[i]))
+
+class SnapshotIndex:
+    # same interface as GraphIndex, backed by memory-mapped arrays that worker processes share
+    def __init__(self, path: str):
+        self.path = path
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.term_offsets = load("term_offsets")
+        self.is_literal = load("is_literal")
+        self.offsets = load("offsets")
+        self.preds = load("preds")
+        self.objs = load("objs")
+        self.typed = load("typed")
+        self.labels = load("labels")
+        self.ranges = load("ranges")
+        self.terms = np.memmap(os.path.join(path, "terms.bin"), dtype=np.uint8, mode="r") \
+            if os.path.getsize(os.path.join(path, "terms.bin")) > 0 else np.zeros(0, dtype=np.uint8)
+        self.typed_entities = TermArray(self, self.typed)
+        self.decoded = {}
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.term_offsets) - 1
+
+    def n3(self, i: int):
+        return self.terms[self.term_offsets[i]:self.term_offsets[i + 1]].tobytes()
+
+    def term(self, i: int):
+        if i not in self.decoded:
+            term = from_n3(self.n3(i).decode("utf-8"))
+            self.decoded[i] = term
+            self.ids[term] = i
+        return self.decoded[i]
+
+    def id(self, term):
+        if term in self.ids:
+            return self.ids[term]
+        # binary search over the sorted n3 strings
+        key = term.n3().encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.n3(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.n3(lo) == key:
+            self.ids[term] = lo
+            return lo
+        return None
+
+    def edge_arrays(self):
+        return self.offsets, self.preds, self.objs, self.is_literal, self.typed
+
+    def neighbors(self, entity):
+        i = self.id(entity)
+        if i is None:
+            return []
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return [(self.term(int(p)), self.term(int(o))) for p, o in zip(self.preds[start:end], self.objs[start:end])]
+
+    def label(self, entity):
+        i = self.id(entity)
+        if i is None or self.labels[i] < 0:
+            return None
+        return self.term(int(self.labels[i]))
+
+    def range(self, prop):
+        i = self.id(prop)
+        if i is None or self.ranges[i] < 0:
+            return None
+        return self.term(int(self.ranges[i]))
@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import Metrics
+
+AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.11 (KHTML, like Gecko) Chrome/23.0.1271.64 Safari/537.11"
+
+class SPARQLError(Exception):
+    def __init__(self, message, status = None, retry_after = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class RateLimiter:
+    # token bucket, rate requests per second with bursts of up to burst requests
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class SPARQLClient:
+    # thread-safe replacement for a shared SPARQLWrapper: keep-alive pool, retries, backoff and rate limit
+    def __init__(self, endpoint: str, connections: int = 8, retries: int = 5, backoff: float = 1, max_backoff: float = 60,
+                 rate: float = None, burst: int = None, timeout: float = 60, agent: str = AGENT, metrics: Metrics = None):
+        self.endpoint = endpoint
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate, burst) if rate else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"User-Agent": agent, "Accept": "application/sparql-results+json"})
+        self.executor = ThreadPoolExecutor(max_workers=connections)
+
+    def select(self, query: str, timeout: float = None):
+        # a given timeout is the budget of the whole call, retries included
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        error = None
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                budget = self.timeout if expires_at is None else min(self.timeout, max(0.0, expires_at - time.monotonic()))
+                if budget <= 0:
+                    raise TimeoutError("Execution timed out!")
+                return self.__request(query, budget)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except SPARQLError as e:
+                if e.status != 429 and e.status < 500:
+                    raise
+                error = e
+            self.metrics.count("sparql.failures")
+            if attempt < self.retries:
+                self.metrics.count("sparql.retries")
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * (0.5 + random.random())
+                if isinstance(error, SPARQLError) and error.retry_after is not None:
+                    delay = max(delay, error.retry_after)
+                if expires_at is not None and time.monotonic() + delay >= expires_at:
+                    raise TimeoutError("Execution timed out!")
+                time.sleep(delay)
+        raise error
+
+    def select_many(self, queries, timeout: float = None):
+        # results in the order of the queries
+        return list(self.executor.map(lambda query: self.select(query, timeout), queries))
+
+    def submit(self, query: str, timeout: float = None):
+        return self.executor.submit(self.select, query, timeout)
+
+    def __request(self, query, timeout):
+        # short queries as GET so endpoint caches can answer them, long ones as POST
+        self.metrics.count("sparql.requests")
+        with self.metrics.time("sparql"):
+            if len(query) < 1500:
+                response = self.session.get(self.endpoint, params={"query": query}, timeout=timeout)
+            else:
+                response = self.session.post(self.endpoint, data={"query": query}, timeout=timeout)
+        if response.status_code != 200:
+            retry_after = response.headers.get("Retry-After")
+            retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+            raise SPARQLError(f"{response.status_code} from {self.endpoint}: {response.text[:200]}", response.status_code, retry_after)
+        return response.json()['results']['bindings']
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
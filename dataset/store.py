@@ -0,0 +1,306 @@
+import json
+import os
+import random
+import sqlite3
+from collections import OrderedDict
+from rdflib import Graph
+from rdflib.namespace import RDF, RDFS
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+from rdflib.store import Store
+from rdflib.util import from_n3
+from dedup import parse_query
+from snapshot import file_sha256, source_meta
+from util import constant_ids, is_excluded_prop, reopened
+
+# 2: smallest label and range ids instead of the first ones in the file
+STORE_VERSION = 2
+BATCH_SIZE = 10000
+
+def default_store_path(source: str):
+    return source + ".store"
+
+class TripleSink(Store):
+    # rdflib store that keeps nothing, every parsed triple goes straight to the callback
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+
+    def add(self, triple, context = None, quoted = False):
+        self.callback(*triple)
+
+    # the n-triples parser talks to a sink directly, without a graph in between
+    def triple(self, s, p, o):
+        self.callback(s, p, o)
+
+def stream_triples(source: str, callback):
+    # n-triples is read line by line; other formats go through rdflib's parsers, which may read the whole file
+    # but still never hold the parsed graph
+    sink = TripleSink(callback)
+    if source.endswith(".nt"):
+        with open(source, "rb") as f:
+            W3CNTriplesParser(sink).parse(f)
+    else:
+        Graph(store=sink).parse(source)
+
+def build_store(source: str, excluded_props, path: str = None, memory_mb: int = 512, max_depth: int = 3):
+    # one streaming pass into a staging table, then sqlite sorts, joins and indexes on disk within its page cache
+    path = path or default_store_path(source)
+    staging = path + ".tmp"
+    for leftover in (staging, staging + "-journal"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    db = sqlite3.connect(staging)
+    db.execute("pragma journal_mode=off")
+    db.execute("pragma synchronous=off")
+    db.execute("pragma temp_store=file")
+    db.execute(f"pragma cache_size={-memory_mb * 1024 // 2}")
+    db.execute("create table raw (s text, p text, o text, kept integer)")
+
+    excluded = {}
+    rows = []
+    def add(s, p, o):
+        if p not in excluded:
+            excluded[p] = is_excluded_prop(p, excluded_props)
+        rows.append((s.n3(), p.n3(), o.n3(), 0 if excluded[p] else 1))
+        if len(rows) >= BATCH_SIZE:
+            db.executemany("insert into raw values (?, ?, ?, ?)", rows)
+            rows.clear()
+    stream_triples(source, add)
+    db.executemany("insert into raw values (?, ?, ?, ?)", rows)
+
+    # ids follow the n3 order like in a snapshot, so a seeded run picks the same entities every time
+    db.execute("create table terms (id integer primary key, n3 text not null, literal integer not null)")
+    db.execute("""insert into terms (n3, literal)
+                  select n3, substr(n3, 1, 1) = '"' from (select s as n3 from raw union select p from raw union select o from raw)
+                  order by n3""")
+    db.execute("create unique index terms_n3 on terms (n3)")
+    # clustered by subject, the edges of one entity are a single range of the b-tree
+    db.execute("create table edges (s integer, p integer, o integer, primary key (s, p, o)) without rowid")
+    db.execute("""insert or ignore into edges select ts.id, tp.id, tobj.id from raw
+                  join terms ts on ts.n3 = raw.s join terms tp on tp.n3 = raw.p join terms tobj on tobj.n3 = raw.o
+                  where raw.kept""")
+    # answering ?x p o patterns starts from the object
+    db.execute("create index edges_o on edges (o, p)")
+    db.execute("create table typed (rank integer primary key, id integer not null)")
+    db.execute("insert into typed (id) select distinct ts.id from raw join terms ts on ts.n3 = raw.s where raw.p = ? order by ts.id",
+               (RDF.type.n3(),))
+    # the label and range with the smallest id win, ids follow the n3 order, like in GraphIndex and snapshots
+    for table, prop in (("labels", RDFS.label), ("ranges", RDFS.range)):
+        db.execute(f"create table {table} (s integer primary key, o integer not null)")
+        db.execute(f"""insert into {table} select ts.id, min(tobj.id) from raw
+                       join terms ts on ts.n3 = raw.s join terms tobj on tobj.n3 = raw.o where raw.p = ? group by ts.id""",
+                   (prop.n3(),))
+    db.execute("drop table raw")
+
+    # reach(d, id): a chain of d hops can start at id, every hop but the last through a non-literal object;
+    # chains(id) counts them for the distribution report, literals never have edges so joins drop them
+    db.execute("create table reach (d integer, id integer, primary key (d, id)) without rowid")
+    db.execute("create temp table chains_1 as select s as id, count(*) as n from edges group by s")
+    db.execute("insert into reach select 1, id from chains_1")
+    for d in range(2, max_depth + 1):
+        db.execute(f"""create temp table chains_{d} as select e.s as id, sum(c.n) as n from edges e
+                       join chains_{d - 1} c on c.id = e.o group by e.s""")
+        db.execute(f"insert into reach select {d}, id from chains_{d}")
+    db.execute("create table starts (d integer, rank integer, id integer, primary key (d, rank)) without rowid")
+    distribution = {}
+    for d in range(1, max_depth + 1):
+        db.execute(f"""insert into starts select {d}, row_number() over (order by t.id) - 1, t.id from typed t
+                       join reach r on r.d = {d} and r.id = t.id""")
+        starts, chains = db.execute(f"select count(*), coalesce(sum(c.n), 0) from typed t join chains_{d} c on c.id = t.id").fetchone()
+        distribution[d] = {"starts": starts, "chains": chains}
+
+    meta = source_meta(source, excluded_props)
+    meta.update(store_version=STORE_VERSION, sha256=file_sha256(source), max_depth=max_depth, distribution=distribution)
+    db.execute("create table meta (value text)")
+    db.execute("insert into meta values (?)", (json.dumps(meta),))
+    db.commit()
+    db.execute("vacuum")
+    db.close()
+    # renamed last, a half-built store is never picked up
+    os.replace(staging, path)
+    return path
+
+def read_meta(path: str):
+    if not os.path.exists(path):
+        return None
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return json.loads(db.execute("select value from meta").fetchone()[0])
+    except sqlite3.Error:
+        return None
+    finally:
+        db.close()
+
+def is_fresh(source: str, excluded_props, path: str):
+    meta = read_meta(path)
+    if meta is None or meta.get("store_version") != STORE_VERSION:
+        return False
+    current = source_meta(source, excluded_props)
+    if meta["version"] != current["version"] or meta["excluded_props"] != current["excluded_props"]:
+        return False
+    if meta["size"] != current["size"]:
+        return False
+    # touched but maybe not changed, the hash decides; the store itself is opened read-only so it is not updated
+    return meta["mtime"] == current["mtime"] or meta["sha256"] == file_sha256(source)
+
+def load_store(source: str, excluded_props, path: str = None, memory_mb: int = 512):
+    path = path or default_store_path(source)
+    if not is_fresh(source, excluded_props, path):
+        print("Store missing or stale, rebuilding")
+        build_store(source, excluded_props, path, memory_mb)
+    return StoreIndex(path, memory_mb)
+
+class TypedEntities:
+    # sequence view over the typed table, random.choice reads one row
+    def __init__(self, index):
+        self.index = index
+        self.size = None
+
+    def __len__(self):
+        if self.size is None:
+            self.size = self.index.execute("select count(*) from typed").fetchone()[0]
+        return self.size
+
+    def __getitem__(self, i):
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        return self.index.term(self.index.execute("select id from typed where rank = ?", (i + 1,)).fetchone()[0])
+
+class StoreIndex:
+    # same interface as GraphIndex, backed by a sqlite file: memory is the page cache plus a bounded term cache,
+    # whatever the size of the graph
+    def __init__(self, path: str, memory_mb: int = 512):
+        self.path = path
+        self.memory_mb = memory_mb
+        self.meta = read_meta(path)
+        self.max_depth = self.meta["max_depth"]
+        # half of the budget for sqlite pages, a quarter for decoded terms at roughly 1 KB each
+        self.cache_entries = max(1000, memory_mb * 1024 // 4)
+        self.decoded = OrderedDict()
+        self.ids = OrderedDict()
+        self.typed_entities = TypedEntities(self)
+        self.db = None
+        self.pid = None
+
+    def execute(self, query, parameters = ()):
+        if reopened(self):
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self.db.execute(f"pragma cache_size={-self.memory_mb * 1024 // 2}")
+            self.db.execute("pragma mmap_size=0")
+            self.decoded = OrderedDict()
+            self.ids = OrderedDict()
+        return self.db.execute(query, parameters)
+
+    def __remember(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.cache_entries:
+            cache.popitem(last=False)
+
+    def term(self, i: int):
+        if i in self.decoded:
+            self.decoded.move_to_end(i)
+            return self.decoded[i]
+        term = from_n3(self.execute("select n3 from terms where id = ?", (i,)).fetchone()[0])
+        self.__remember(self.decoded, i, term)
+        return term
+
+    def id(self, term):
+        if term in self.ids:
+            self.ids.move_to_end(term)
+            return self.ids[term]
+        row = self.execute("select id from terms where n3 = ?", (term.n3(),)).fetchone()
+        i = row[0] if row is not None else None
+        self.__remember(self.ids, term, i)
+        return i
+
+    def neighbors(self, entity):
+        i = self.id(entity)
+        if i is None:
+            return []
+        rows = self.execute("select p, o from edges where s = ?", (i,)).fetchall()
+        return [(self.term(p), self.term(o)) for (p, o) in rows]
+
+    def label(self, entity):
+        return self.__lookup("labels", entity)
+
+    def range(self, prop):
+        return self.__lookup("ranges", prop)
+
+    def __lookup(self, table, term):
+        i = self.id(term)
+        if i is None:
+            return None
+        row = self.execute(f"select o from {table} where s = ?", (i,)).fetchone()
+        return self.term(row[0]) if row is not None else None
+
+class StorePaths:
+    # PathIndex over a store: chain lengths were computed when the store was built, so every hop is drawn
+    # uniformly among the edges that can still finish the chain with one indexed query
+    def __init__(self, index: StoreIndex, max_depth: int = 3):
+        if max_depth > index.max_depth:
+            raise ValueError(f"The store knows chains up to depth {index.max_depth}, rebuild it for {max_depth}")
+        self.index = index
+        self.max_depth = max_depth
+        self.sizes = {}
+
+    def chain(self, depth: int, rng = random):
+        if depth < 1 or depth > self.max_depth:
+            raise ValueError(f"Depth {depth} outside 1..{self.max_depth}")
+        if depth not in self.sizes:
+            self.sizes[depth] = self.index.execute("select count(*) from starts where d = ?", (depth,)).fetchone()[0]
+        if self.sizes[depth] == 0:
+            raise LookupError(f"No chain of depth {depth} in the graph")
+        subject = self.index.execute("select id from starts where d = ? and rank = ?",
+                                     (depth, rng.randrange(self.sizes[depth]))).fetchone()[0]
+        triples = []
+        for left in range(depth, 0, -1):
+            if left == 1:
+                edges = self.index.execute("select p, o from edges where s = ?", (subject,)).fetchall()
+            else:
+                edges = self.index.execute("select e.p, e.o from edges e join reach r on r.d = ? and r.id = e.o where e.s = ?",
+                                           (left - 1, subject)).fetchall()
+            p, o = edges[rng.randrange(len(edges))]
+            triples.append((self.index.term(subject), self.index.term(p), self.index.term(o)))
+            subject = o
+        return triples
+
+    def distribution(self):
+        return {int(d): report for d, report in self.index.meta["distribution"].items() if int(d) <= self.max_depth}
+
+class StoreAnswers:
+    # LocalAnswers over a store: a generated query becomes one sql self-join of the edges table
+    def __init__(self, index: StoreIndex, limit: int = 1000):
+        self.index = index
+        self.limit = limit
+
+    def answer_many(self, queries, count: bool, timeout: float = None):
+        return [self.answer(query, count) for query in queries]
+
+    def answer(self, query: str, count: bool):
+        parsed = parse_query(query)
+        if parsed is None:
+            raise ValueError(f"Cannot evaluate {query}")
+        head, triples = parsed
+        target = next(t for t in head if t.startswith("?"))
+        tables, conditions, parameters, columns = [], [], [], {}
+        for n, triple in enumerate(triples):
+            tables.append(f"edges e{n}")
+            for term, column in zip(triple, (f"e{n}.s", f"e{n}.p", f"e{n}.o")):
+                if term.startswith("?"):
+                    if column.endswith(".p"):
+                        raise ValueError("Variable predicates are not supported")
+                    if term in columns:
+                        conditions.append(f"{column} = {columns[term]}")
+                    else:
+                        columns[term] = column
+                    continue
+                ids = constant_ids(self.index, term)
+                if not ids:
+                    return 0 if count else []
+                conditions.append(f"{column} in ({', '.join('?' * len(ids))})")
+                parameters.extend(ids)
+        where = " and ".join(conditions) or "1"
+        if count:
+            return self.index.execute(f"select count(*) from {', '.join(tables)} where {where}", parameters).fetchone()[0]
+        rows = self.index.execute(f"select distinct {columns[target]} from {', '.join(tables)} where {where}", parameters)
+        return sorted(str(self.index.term(i)) for (i,) in rows)[:self.limit]
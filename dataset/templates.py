@@ -0,0 +1,123 @@
+import re
+import zlib
+from metrics import Metrics
+
+LABEL_LINE = re.compile(r"^(.*?) has human-readable name '(.*)'$")
+PATTERN_END = re.compile(r"\s*\.(?:\s+(?=\?)|\s*$)")
+
+def parse_description(mapping_in_sentence: str):
+    # the 'term has human-readable name label' lines of the generator back into a dict
+    labels = {}
+    for line in mapping_in_sentence.split("\n"):
+        matched = LABEL_LINE.match(line.strip())
+        if matched:
+            labels[matched.group(1)] = matched.group(2)
+    return labels
+
+def local_name(term: str):
+    # dbo:birthPlace and <http://dbpedia.org/ontology/birthPlace> both read 'birth place', names keep their case
+    name = re.split(r"[/#:]", term.strip("<>"))[-1].replace("_", " ")
+    if name[:1].islower():
+        name = re.sub(r"(?<=[a-z0-9])([A-Z])", lambda m: " " + m.group(1).lower(), name)
+    return name
+
+def literal_value(term: str):
+    quote = term[0]
+    return term[1:term.rindex(quote)]
+
+class TemplateVerbalizer:
+    # questions from the query shape and the labels of its terms, deterministic and without any model
+    # same interface as Verbalizer, so the generator does not know which one it talks to
+    def __init__(self, chunk_size: int = 256, metrics: Metrics = None):
+        self.chunk_size = chunk_size
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    @property
+    def config(self):
+        return {"backend": "template", "chunk_size": self.chunk_size}
+
+    def close(self):
+        pass
+
+    def verbalize(self, query, mapping_in_sentence, deadline = None):
+        return self.verbalize_many([(query, mapping_in_sentence)])[0]
+
+    def verbalize_many(self, items, deadlines = None):
+        # None for a query shape no template covers
+        questions = []
+        for query, mapping_in_sentence in items:
+            question = self.render(query, parse_description(mapping_in_sentence))
+            self.metrics.count("template.rendered" if question is not None else "template.unsupported")
+            questions.append(question)
+        return questions
+
+    async def averbalize_many(self, items, deadlines = None):
+        return self.verbalize_many(items, deadlines)
+
+    def render(self, query: str, labels: dict):
+        if "{" not in query or "}" not in query:
+            return None
+        head, body = query[:query.index("{")], query[query.index("{") + 1:query.rindex("}")]
+        count = "count" in head.lower()
+        # generated literals are not escaped, so patterns are split on the ' . ' in front of the next
+        # variable and the object is whatever follows the predicate
+        triples = [part.split(None, 2) for part in PATTERN_END.split(body.strip()) if part.strip()]
+        if not triples or any(len(t) != 3 or t[1].startswith("?") for t in triples):
+            return None
+        # the same query always gets the same wording
+        variant = zlib.crc32(query.encode("utf-8"))
+        label = lambda term: self.__label(term, labels)
+        # 'has author' reads better as 'the author of' and 'entities that have author'
+        noun = lambda term: re.sub(r"^has\s+", "", label(term))
+
+        if len(triples) == 1 and triples[0][2] == "?x" and not triples[0][0].startswith("?"):
+            # s p ?x
+            s, p, _ = triples[0]
+            if count:
+                return f"How many {noun(p)} does {label(s)} have?"
+            forms = ["What is the {p} of {s}?", "What is {s}'s {p}?"]
+            return forms[variant % len(forms)].format(p=noun(p), s=label(s))
+
+        if all(t[0] == "?x" and not t[2].startswith("?") for t in triples):
+            # ?x p o, one or more constraints on the answer
+            constraints = " and ".join(f"{noun(p)} {label(o)}" for (_, p, o) in triples)
+            if count:
+                return f"How many entities have {constraints}?"
+            forms = ["Which entities have {c}?", "What has {c}?", "Name the entities with {c}."]
+            return forms[variant % len(forms)].format(c=constraints)
+
+        chain = self.__chain(triples)
+        if chain is None:
+            return None
+        # ?x p1 ?y . ?y p2 o reads 'a p1 with p2 o'
+        phrase = f"{noun(chain[-1][1])} {label(chain[-1][2])}"
+        for (_, p, _) in reversed(chain[:-1]):
+            phrase = f"a {noun(p)} with {phrase}"
+        if count:
+            return f"How many entities have {phrase}?"
+        forms = ["Which entities have {c}?", "What has {c}?"]
+        return forms[variant % len(forms)].format(c=phrase)
+
+    def __chain(self, triples):
+        # orders ?x ... ?y ... o patterns from the answer outwards, None if they do not form one path
+        by_subject = {t[0]: t for t in triples}
+        if len(by_subject) != len(triples):
+            return None
+        chain, current = [], "?x"
+        while current in by_subject:
+            triple = by_subject.pop(current)
+            chain.append(triple)
+            current = triple[2]
+        if by_subject or current.startswith("?"):
+            return None
+        return chain
+
+    def __label(self, term, labels):
+        if term in labels:
+            return labels[term]
+        if term.startswith("<") and term[1:-1] in labels:
+            return labels[term[1:-1]]
+        if term[0] in "'\"":
+            value = literal_value(term)
+            return labels.get(value, value)
+        return local_name(term)
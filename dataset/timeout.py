@@ -1,27 +1,35 @@
-import signal, threading
-from contextlib import contextmanager
+import math
+import time
 
-def timeout_handler(signum, frame):
-    raise TimeoutError("Execution timed out!")
+class Deadline:
+    # cooperative time budget: nothing gets interrupted, the work checks it and derives request timeouts from it,
+    # so it behaves the same in threads, worker processes and asyncio tasks
+    def __init__(self, seconds: float = None, parent = None):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        if parent is not None and parent.expires_at is not None:
+            self.expires_at = parent.expires_at if self.expires_at is None else min(self.expires_at, parent.expires_at)
 
-# TODO: fix this, still failing
-def timeout_windows(seconds):
-    timer = threading.Timer(seconds, lambda: (_ for _ in ()).throw(TimeoutError("Execution timed out!")))
-    timer.start()
-    return timer
+    def remaining(self):
+        if self.expires_at is None:
+            return math.inf
+        return max(0.0, self.expires_at - time.monotonic())
 
-@contextmanager
-def timeout(seconds):
-    if hasattr(signal, 'SIGALRM'):  # Unix-like systems
-        signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(seconds)
-        try:
-            yield
-        finally:
-            signal.alarm(0)
-    else:  # Windows
-        timer = timeout_windows(seconds)
-        try:
-            yield
-        finally:
-            timer.cancel()
\ No newline at end of file
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        if self.expired:
+            raise TimeoutError("Execution timed out!")
+
+    def stage(self, seconds: float = None):
+        # budget for one stage, never longer than what is left of this one
+        return Deadline(seconds, parent=self)
+
+    def request_timeout(self, cap: float = None):
+        # timeout for a single http or llm request made inside this budget
+        self.check()
+        remaining = self.remaining()
+        if cap is not None:
+            remaining = min(remaining, cap)
+        return None if math.isinf(remaining) else remaining
@@ -1,4 +1,7 @@
+import os
 import re
+import sys
+import validators
 
 def get_next_variable(curr):
     if curr == "w":
@@ -13,6 +16,9 @@ def get_next_variable(curr):
     else:
         return curr[:-1] + chr(ord(last_char) + 1)
 
+def to_count_query(query):
+    return query.replace("?x", "(count(?x) as ?cnt)", 1)
+
 def replace_prefix_wikidata(iri):
     iri = iri.replace("http://www.wikidata.org/prop/direct/", "wdt:")
     iri = iri.replace("http://www.wikidata.org/entity/", "wd:")
@@ -27,6 +33,14 @@ def is_wikidata_entity_iri(iri):
         return True
     return False
 
+def is_acceptable_wikidata_edge(p, o):
+    # direct claims only, no instance-of, no statement nodes and no iris outside wikidata
+    if "P31" in p or not p.startswith("http://www.wikidata.org/prop/direct"):
+        return False
+    if o.startswith("http://www.wikidata.org/entity/statement/"):
+        return False
+    return not (validators.url(o) and not is_wikidata_entity_iri(o))
+
 def replace_prefix_dbpedia(iri):
     iri = iri.replace("http://dbpedia.org/resource/Category:", "dbc:")
     iri = iri.replace("http://dbpedia.org/datatype/", "dbd:")
@@ -39,6 +53,9 @@ def is_dbpedia_entity_iri(iri):
     tmp = replace_prefix_dbpedia(iri)
     return tmp != iri
 
+def is_acceptable_dbpedia_edge(p, o):
+    return p.startswith("http://dbpedia.org/ontology/") and "wiki" not in p
+
 def concat_str_with_datatype(literal):
     datetime_pattern = r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$"
     if bool(re.fullmatch(datetime_pattern, literal)):
@@ -49,4 +66,33 @@ def concat_str_with_datatype(literal):
 def concat_str_with_datatype_rdflib(literal):
     if type(literal) is int:
         return literal
-    return f'{literal}'
\ No newline at end of file
+    return f'{literal}'
+
+def is_excluded_prop(p, excluded_props):
+    # same semantics as the contains(str(?p), ...) filter of the remote queries
+    return any(uri in str(p) for uri in excluded_props)
+
+def constant_ids(index, term: str):
+    # the ids of a local index that a constant of a generated query matches, none when it is not in the graph
+    from rdflib import Literal
+    from rdflib.namespace import XSD
+    from rdflib.util import from_n3
+    value = from_n3(term)
+    ids = [index.id(value)]
+    if isinstance(value, Literal) and value.datatype is None and value.language is None:
+        # rdf 1.1: a simple literal and an xsd:string one are the same value
+        ids.append(index.id(Literal(str(value), datatype=XSD.string)))
+    return [i for i in ids if i is not None]
+
+def reopened(owner):
+    # sqlite handles do not survive fork, every process opens its own: true the first time owner is used in
+    # this process, owner.pid remembers which process opened owner.db
+    if owner.pid == os.getpid():
+        return False
+    owner.pid = os.getpid()
+    return True
+
+def is_literal(value):
+    # rdflib is only imported for local sources, before that nothing can be a Literal
+    rdflib = sys.modules.get("rdflib")
+    return rdflib is not None and isinstance(value, rdflib.Literal)
@@ -0,0 +1,219 @@
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from timeout import Deadline
+from metrics import Metrics
+from llm_cache import ResponseCache, response_key
+
+def clean_question(result):
+    # the model likes to answer with 'Here is the question: "..."'
+    if "Here" in result:
+        matched = re.search(r'"(.*?)"', result, re.DOTALL)
+        if matched:
+            return matched.group(1)
+        return result
+    return result
+
+def build_prompt(query, mapping_in_sentence):
+    return f"""Having a SPARQL query:
+{query}
+Where:
+{mapping_in_sentence}
+Transform the SPARQL query to a natural language question.
+Output just the transformed question
+    """
+
+def build_batch_prompt(items):
+    blocks = []
+    for i, (query, mapping_in_sentence) in enumerate(items, start=1):
+        blocks.append(f"""Query {i}:
+{query}
+Where:
+{mapping_in_sentence}""")
+    joined = "\n".join(blocks)
+    return f"""Having {len(items)} SPARQL queries:
+{joined}
+Transform every SPARQL query to a natural language question.
+Output exactly one line per query in the form '<number>. <question>' and nothing else
+    """
+
+def build_paraphrase_prompt(query, question):
+    return f"""Having a SPARQL query:
+{query}
+And a question generated from it by a template:
+{question}
+Rewrite the question so it sounds natural, keeping exactly the meaning of the query.
+Output just the rewritten question
+    """
+
+def build_batch_paraphrase_prompt(items):
+    blocks = []
+    for i, (query, question) in enumerate(items, start=1):
+        blocks.append(f"""Query {i}:
+{query}
+Template question {i}:
+{question}""")
+    joined = "\n".join(blocks)
+    return f"""Having {len(items)} SPARQL queries with questions generated from them by a template:
+{joined}
+Rewrite every question so it sounds natural, keeping exactly the meaning of its query.
+Output exactly one line per question in the form '<number>. <question>' and nothing else
+    """
+
+def run_sync(coroutine):
+    # asyncio.run cannot be nested: called from a running event loop the coroutine gets its own loop on a helper
+    # thread, async callers should await the a* methods instead of blocking their loop here
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+def parse_batch_result(result, size):
+    questions = [None] * size
+    for line in result.split("\n"):
+        matched = re.match(r"^\s*(?:Query\s*)?(\d+)\s*[.):]\s*(.+)$", line)
+        if matched:
+            i = int(matched.group(1)) - 1
+            if 0 <= i < size and questions[i] is None:
+                questions[i] = clean_question(matched.group(2).strip())
+    return questions
+
+class Verbalizer:
+    # turns (query, mapping description) pairs into questions with several requests in flight
+    def __init__(self, chat_model = None, concurrency: int = 4, batch_size: int = 1, timeout: float = 60, retries: int = 2,
+                 metrics: Metrics = None, cache_path: str = None, cache_mode: str = "readwrite", cache_size: int = 200000,
+                 model_id: str = None, model_params: dict = None, backend: str = "hf", backend_options: dict = None):
+        if chat_model is None:
+            # the client itself is built on the first call, see __model
+            from llm import model_kwargs, repo_id
+            model_id = model_id or repo_id
+            model_params = model_params if model_params is not None else model_kwargs
+        self.chat_model = chat_model
+        # how a worker process rebuilds the chat model, see backends.build_verbalizer
+        self.backend = backend
+        self.backend_options = backend_options or {}
+        # what the cache key is made of besides the prompt
+        self.model_id = model_id or type(chat_model).__name__
+        self.model_params = model_params or {}
+        self.cache_path = cache_path
+        self.cache_mode = cache_mode
+        self.cache_size = cache_size
+        self.cache = ResponseCache(cache_path, cache_mode, cache_size) if cache_path and cache_mode != "off" else None
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.retries = retries
+        # the generator swaps in its own metrics so llm calls land next to the other stages
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    @property
+    def config(self):
+        # everything a spawned worker needs to build an equivalent verbalizer
+        return {
+            "backend": self.backend,
+            "backend_options": self.backend_options,
+            "concurrency": self.concurrency,
+            "batch_size": self.batch_size,
+            "timeout": self.timeout,
+            "retries": self.retries,
+            "cache_path": self.cache_path,
+            "cache_mode": self.cache_mode,
+            "cache_size": self.cache_size,
+        }
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+    @property
+    def chunk_size(self):
+        # enough entries to keep every slot busy
+        return self.concurrency * self.batch_size
+
+    def verbalize(self, query, mapping_in_sentence, deadline: Deadline = None):
+        return self.verbalize_many([(query, mapping_in_sentence)], [deadline])[0]
+
+    def verbalize_many(self, items, deadlines = None):
+        return run_sync(self.averbalize_many(items, deadlines))
+
+    def paraphrase_many(self, items, deadlines = None):
+        return run_sync(self.aparaphrase_many(items, deadlines))
+
+    async def averbalize_many(self, items, deadlines = None):
+        # returns one question per item, None where every attempt failed or its deadline ran out
+        deadlines = [d if d is not None else Deadline() for d in (deadlines or [None] * len(items))]
+        return await self.__verbalize_all(items, deadlines, (build_prompt, build_batch_prompt))
+
+    async def aparaphrase_many(self, items, deadlines = None):
+        # (query, template question) pairs, None where the model gave no usable rewrite
+        deadlines = [d if d is not None else Deadline() for d in (deadlines or [None] * len(items))]
+        return await self.__verbalize_all(items, deadlines, (build_paraphrase_prompt, build_batch_paraphrase_prompt))
+
+    async def __verbalize_all(self, items, deadlines, prompts):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        if self.batch_size <= 1:
+            return await asyncio.gather(*(self.__single(item, deadline, semaphore, prompts) for item, deadline in zip(items, deadlines)))
+        chunks = [(items[i:i + self.batch_size], deadlines[i:i + self.batch_size]) for i in range(0, len(items), self.batch_size)]
+        results = await asyncio.gather(*(self.__batch(chunk, chunk_deadlines, semaphore, prompts) for chunk, chunk_deadlines in chunks))
+        questions = [question for chunk in results for question in chunk]
+        # whatever the model skipped in a batch gets asked on its own
+        missing = [i for i, question in enumerate(questions) if question is None]
+        retried = await asyncio.gather(*(self.__single(items[i], deadlines[i], semaphore, prompts) for i in missing))
+        for i, question in zip(missing, retried):
+            questions[i] = question
+        return questions
+
+    async def __single(self, item, deadline, semaphore, prompts):
+        result = await self.__invoke(prompts[0](*item), deadline, semaphore)
+        return None if result is None else clean_question(result)
+
+    async def __batch(self, chunk, deadlines, semaphore, prompts):
+        if len(chunk) == 1:
+            return [await self.__single(chunk[0], deadlines[0], semaphore, prompts)]
+        # a shared prompt has to finish within the tightest budget of its items
+        deadline = min(deadlines, key=lambda d: d.remaining())
+        result = await self.__invoke(prompts[1](chunk), deadline, semaphore)
+        if result is None:
+            return [None] * len(chunk)
+        return parse_batch_result(result, len(chunk))
+
+    async def __invoke(self, prompt, deadline, semaphore):
+        key = None
+        if self.cache is not None:
+            key = response_key(self.model_id, self.model_params, prompt)
+            content = self.cache.get(key)
+            self.metrics.cache("llm_cache", content is not None)
+            if content is not None:
+                return content
+        content = await self.__call(prompt, deadline, semaphore)
+        if content is not None and key is not None:
+            self.cache.put(key, content)
+        return content
+
+    def __model(self):
+        if self.chat_model is None:
+            from llm import new_chat_model
+            self.chat_model = new_chat_model()
+        return self.chat_model
+
+    async def __call(self, prompt, deadline, semaphore):
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.metrics.count("llm.requests")
+                    with self.metrics.time("llm"):
+                        result = await asyncio.wait_for(self.__model().ainvoke(prompt), deadline.request_timeout(self.timeout))
+                    return result.content
+                except Exception as e:
+                    self.metrics.count("llm.failures")
+                    if deadline.expired:
+                        print("LLM budget exhausted")
+                        return None
+                    print(f"LLM error ({type(e).__name__}), attempt {attempt + 1} of {self.retries + 1}")
+                if attempt < self.retries:
+                    if deadline.remaining() <= 2 ** attempt:
+                        return None
+                    await asyncio.sleep(2 ** attempt)
+        return None